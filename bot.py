@@ -1,5 +1,6 @@
 
 import sys
+import signal
 import asyncio
 import logging
 import nest_asyncio
@@ -19,6 +20,15 @@ from telegram.ext import (
 )
 from modules.config import BOT_TOKEN, ADMIN_ID, HTTPS_PROXY, check_auth
 from modules.handlers_main import start, router_callback, router_text, reset_state, login_cmd
+from modules.accounts import alist_mgr
+from modules.cache import listing_cache
+from modules.streamer import stop_all_sessions
+from modules.relay import relay
+from modules.mediacache import media_cache
+from modules.msgedit import message_editor
+from modules.config import RELAY_ENABLED, TELEGRAM_API_BASE, WEBHOOK_ENABLED, UPDATE_CONCURRENCY
+from modules.locks import per_user
+from modules.webhook import WebhookServer, webhook_url
 
 # Configure Logging
 logging.basicConfig(
@@ -33,6 +43,11 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     print(f"❌ [ERROR] {context.error}")
 
 async def on_startup(context: ContextTypes.DEFAULT_TYPE):
+    listing_cache.start_sweeper()
+    if RELAY_ENABLED:
+        try: await relay.start()
+        except OSError as e: logger.error(f"Media relay disabled, ffmpeg will read upstream directly: {e}")
+
     # Notify Admin
     if ADMIN_ID:
         try:
@@ -40,6 +55,42 @@ async def on_startup(context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(chat_id=ADMIN_ID, text=msg, parse_mode='Markdown')
         except: pass
 
+async def on_shutdown(context: ContextTypes.DEFAULT_TYPE):
+    await stop_all_sessions()
+    await relay.stop()
+    await media_cache.close()
+    await listing_cache.stop_sweeper()
+    await message_editor.close()
+    # Release pooled AList connections
+    await alist_mgr.close()
+
+async def run_webhook(app):
+    """Same lifecycle as run_polling, but updates arrive on the local webhook server"""
+    server = WebhookServer(app)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError): pass # Ctrl+C still raises KeyboardInterrupt
+
+    await app.initialize()
+    try:
+        if app.post_init: await app.post_init(app)
+        await server.start()
+        url = webhook_url()
+        await app.bot.set_webhook(
+            url=url, secret_token=server.secret,
+            allowed_updates=Update.ALL_TYPES, drop_pending_updates=True
+        )
+        await app.start()
+        print(f"✅ Bot is running! Webhook: {url}")
+        await stop.wait()
+    finally:
+        await server.stop()
+        if app.running: await app.stop()
+        await app.shutdown()
+        if app.post_shutdown: await app.post_shutdown(app)
+
 if __name__ == '__main__':
     if not BOT_TOKEN:
         print("❌ Error: BOT_TOKEN is missing in .env")
@@ -68,23 +119,40 @@ if __name__ == '__main__':
 
     # Build App
     try:
-        app = ApplicationBuilder().token(BOT_TOKEN).request(req).post_init(on_startup).build()
+        app = (
+            ApplicationBuilder().token(BOT_TOKEN).request(req)
+            .base_url(f"{TELEGRAM_API_BASE.rstrip('/')}/bot")
+            .base_file_url(f"{TELEGRAM_API_BASE.rstrip('/')}/file/bot")
+            # Slow handlers (resolving, log uploads) no longer block other updates;
+            # per-user and per-stream-key locks keep state consistent
+            .concurrent_updates(UPDATE_CONCURRENCY if UPDATE_CONCURRENCY > 1 else False)
+            .post_init(on_startup).post_shutdown(on_shutdown).build()
+        )
     except Exception as e:
         print(f"❌ Failed to initialize Bot: {e}")
         sys.exit(1)
     
     # Handlers
-    app.add_handler(CommandHandler('start', start))
-    app.add_handler(CommandHandler('reset', reset_state))
+    # Handlers that touch user_data run under the user's lock; router_callback locks per action
+    app.add_handler(CommandHandler('start', per_user(start)))
+    app.add_handler(CommandHandler('reset', per_user(reset_state)))
     app.add_handler(CommandHandler('login', login_cmd))
     
     app.add_handler(CallbackQueryHandler(router_callback))
-    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), router_text))
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), per_user(router_text)))
     
     app.add_error_handler(error_handler)
 
-    print("✅ Bot is running! Waiting for updates...")
-    try:
-        app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES, timeout=40)
-    except Exception as e:
-        print(f"❌ Polling Error: {e}")
+    if WEBHOOK_ENABLED:
+        try:
+            asyncio.run(run_webhook(app))
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"❌ Webhook Error: {e}")
+    else:
+        print("✅ Bot is running! Waiting for updates...")
+        try:
+            app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES, timeout=40)
+        except Exception as e:
+            print(f"❌ Polling Error: {e}")
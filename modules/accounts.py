@@ -1,26 +1,121 @@
-
-import requests
+import asyncio
+import base64
+import json
 import logging
-from .config import ALIST_HOST, ALIST_USER, ALIST_PASS
+import posixpath
+import time
+import aiohttp
+from .config import (
+    ALIST_HOST, ALIST_USER, ALIST_PASS, ALIST_TIMEOUT, ALIST_RETRIES, ALIST_POOL_SIZE,
+    ALIST_TOKEN_REFRESH_MARGIN,
+    WALK_CONCURRENCY, WALK_MAX_DEPTH, WALK_MAX_FILES, WALK_MAX_DIRS, WALK_PAGE_SIZE
+)
+from .cache import listing_cache
 
 logger = logging.getLogger("AList")
 
+def _parent_dir(path):
+    return posixpath.dirname(path.rstrip('/')) or "/"
+
+def _dir_key(path):
+    return path.rstrip('/') or "/"
+
+def _jwt_expiry(token):
+    """'exp' claim of a JWT (AList tokens are JWTs), None if it cannot be read"""
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
 class AListManager:
     def __init__(self):
         self.host = ALIST_HOST.rstrip('/')
         self.username = ALIST_USER
         self.password = ALIST_PASS
         self.token = None
+        self.token_expires = None # Epoch from the JWT, None if unknown
+        self._session = None
+        self._revalidating = {} # (listing cache key, generation) -> refresh task
+        self._generations = {} # directory -> bumped by every invalidation of its listings
+        self._inflight = {} # shared call key -> task (login, fs/list, fs/get)
+
+    # --- Connection Pool ---
+
+    def _get_session(self):
+        """Shared keep-alive session, created lazily inside the running loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=ALIST_POOL_SIZE, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _shared(self, key, factory):
+        """Run factory() once for every concurrent caller with the same key (single flight)"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(factory())
+
+            def done(t):
+                if self._inflight.get(key) is t: del self._inflight[key]
+                if not t.cancelled(): t.exception() # Retrieved even if every caller gave up
+
+            task.add_done_callback(done)
+        # A caller being cancelled must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
 
-    def login(self):
-        """Get Token from AList"""
+    async def _request(self, method, endpoint, payload=None, params=None, auth=True,
+                       timeout=ALIST_TIMEOUT, idempotent=True):
+        """
+        Call AList and return the decoded JSON body.
+        Idempotent calls are retried on any transport error; mutations are only
+        retried when the connection could not be established (request never sent).
+        A rejected token (HTTP 401 or code 401 in the body) is renewed and the
+        call repeated once.
+        """
+        url = f"{self.host}{endpoint}"
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        attempt = 0
+        relogged = False
+        while True:
+            try:
+                token = await self.ensure_token() if auth else None
+                headers = {"Content-Type": "application/json"}
+                if auth: headers["Authorization"] = token or ""
+                async with self._get_session().request(method, url, json=payload, params=params,
+                                                       headers=headers, timeout=client_timeout) as r:
+                    data = None if r.status == 401 else await r.json(content_type=None)
+                    rejected = r.status == 401 or (isinstance(data, dict) and data.get('code') == 401)
+                    if rejected and auth and not relogged: # Token expired or revoked
+                        relogged = True
+                        await self.ensure_token(rejected=token)
+                        continue
+                    return data if data is not None else await r.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = idempotent or isinstance(e, aiohttp.ClientConnectorError)
+                if not retryable or attempt >= ALIST_RETRIES:
+                    raise
+                attempt += 1
+                logger.warning(f"AList {endpoint} failed ({e!r}), retry {attempt}/{ALIST_RETRIES}")
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+    async def _post(self, endpoint, payload, **kwargs):
+        return await self._request("POST", endpoint, payload, **kwargs)
+
+    # --- Token Lifecycle ---
+
+    async def _login(self):
         try:
-            url = f"{self.host}/api/auth/login"
             payload = {"username": self.username, "password": self.password}
-            r = requests.post(url, json=payload, timeout=10)
-            data = r.json()
+            data = await self._post("/api/auth/login", payload, auth=False, timeout=10)
             if data.get('code') == 200:
                 self.token = data['data']['token']
+                self.token_expires = _jwt_expiry(self.token)
                 return True
             else:
                 logger.error(f"AList Login Failed: {data}")
@@ -29,14 +124,27 @@ class AListManager:
             logger.error(f"AList Connection Error: {e}")
             return False
 
-    def get_headers(self):
-        if not self.token:
-            self.login()
-        return {"Authorization": self.token, "Content-Type": "application/json"}
+    async def login(self):
+        """Get Token from AList; concurrent callers share one login request"""
+        return await self._shared(('login',), self._login)
 
-    def list_files(self, path="/", page=1, per_page=20):
-        if not path: path = "/"
-        url = f"{self.host}/api/fs/list"
+    def _token_usable(self, rejected=None):
+        if not self.token or self.token == rejected: return False
+        if self.token_expires is None: return True
+        return time.time() < self.token_expires - ALIST_TOKEN_REFRESH_MARGIN
+
+    async def ensure_token(self, rejected=None):
+        """Current token, logging in first if there is none, it is about to expire or it was `rejected`"""
+        if not self._token_usable(rejected):
+            await self.login()
+        return self.token
+
+    async def get_headers(self):
+        token = await self.ensure_token()
+        return {"Authorization": token or "", "Content-Type": "application/json"}
+
+    async def _fetch_list(self, key):
+        path, page, per_page = key
         payload = {
             "path": path,
             "password": "",
@@ -44,62 +152,164 @@ class AListManager:
             "per_page": per_page,
             "refresh": False
         }
+        # Identical listings requested at the same time share one upstream call; a fetch
+        # that started before the directory was invalidated is neither joined nor cached
+        gen = self._generation(path)
+        resp = await self._shared(('list', key, gen), lambda: self._post("/api/fs/list", payload))
+        if resp and resp.get('code') == 200 and gen == self._generation(path):
+            listing_cache.set(key, resp)
+        return resp
+
+    def _generation(self, path):
+        return self._generations.get(_dir_key(path), 0)
+
+    def _revalidate(self, key):
+        """Fetch a listing in the background (one in-flight fetch per key and generation)"""
+        slot = (key, self._generation(key[0]))
+        if slot in self._revalidating: return
+
+        async def refresh():
+            try: await self._fetch_list(key)
+            except Exception as e: logger.warning(f"Background refresh of {key[0]} failed: {e}")
+            finally: self._revalidating.pop(slot, None)
+
+        self._revalidating[slot] = asyncio.get_running_loop().create_task(refresh())
+
+    async def list_files(self, path="/", page=1, per_page=20, refresh=False):
+        """Cached listing; stale pages are served instantly and refreshed in the background"""
+        if not path: path = "/"
+        key = (path, page, per_page)
+        if not refresh:
+            cached, stale = listing_cache.lookup(key)
+            if cached is not None:
+                if stale: self._revalidate(key)
+                return cached
         try:
-            r = requests.post(url, json=payload, headers=self.get_headers(), timeout=15)
-            if r.status_code == 401: # Token expired
-                self.login()
-                r = requests.post(url, json=payload, headers=self.get_headers(), timeout=15)
-            return r.json()
+            return await self._fetch_list(key)
         except Exception as e:
             logger.error(f"List files error: {e}")
             return None
 
-    def get_file_info(self, path):
-        url = f"{self.host}/api/fs/get"
+    def prefetch_list(self, path, page, per_page=20):
+        """Warm the listing cache for a page the user is likely to open next"""
+        key = (path or "/", page, per_page)
+        if listing_cache.peek(key) is not None: return # Not a real lookup: keep it out of the stats
+        self._revalidate(key)
+
+    def invalidate_dirs(self, *dirs):
+        """Drop cached listings (all pages) for the given directories, and disown fetches still in flight"""
+        targets = {_dir_key(d) for d in dirs if d}
+        for d in targets: self._generations[d] = self._generations.get(d, 0) + 1
+        listing_cache.invalidate(lambda key: _dir_key(key[0]) in targets)
+
+    async def list_all(self, path, per_page=WALK_PAGE_SIZE):
+        """Every entry of a directory across all pages; None if the first page fails"""
+        resp = await self.list_files(path, page=1, per_page=per_page)
+        if not resp or resp.get('code') != 200: return None
+        entries = list(resp['data'].get('content') or [])
+        total = resp['data'].get('total') or 0
+        page = 1
+        while len(entries) < total:
+            page += 1
+            resp = await self.list_files(path, page=page, per_page=per_page)
+            if not resp or resp.get('code') != 200: break
+            content = resp['data'].get('content') or []
+            if not content: break
+            entries.extend(content)
+        return entries
+
+    async def walk_files(self, root="/", predicate=None, max_depth=WALK_MAX_DEPTH,
+                         max_files=WALK_MAX_FILES, max_dirs=WALK_MAX_DIRS, concurrency=WALK_CONCURRENCY):
+        """
+        Breadth-first walk yielding (full_path, item) for files as each folder's
+        listing arrives. Folders of one level are listed concurrently; the walk
+        stops at max_depth levels, max_files matches or max_dirs listings.
+        """
+        sem = asyncio.Semaphore(max(1, concurrency))
+        found = 0
+        listed = 0
+
+        async def list_dir(path):
+            async with sem:
+                return path, await self.list_all(path)
+
+        level = [root or "/"]
+        for depth in range(max_depth + 1):
+            if not level: break
+            level = level[:max(0, max_dirs - listed)]
+            listed += len(level)
+            tasks = [asyncio.ensure_future(list_dir(d)) for d in level]
+            next_level = []
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    dir_path, entries = await fut
+                    for item in entries or []:
+                        full_path = posixpath.join(dir_path, item['name'])
+                        if item['is_dir']:
+                            next_level.append(full_path)
+                        elif predicate is None or predicate(item):
+                            yield full_path, item
+                            found += 1
+                            if found >= max_files: return
+            finally:
+                for t in tasks: t.cancel()
+            level = next_level
+
+    async def get_file_info(self, path):
         payload = {"path": path, "password": ""}
         try:
-            r = requests.post(url, json=payload, headers=self.get_headers(), timeout=15)
-            return r.json()
+            return await self._shared(('get', path), lambda: self._post("/api/fs/get", payload))
+        except Exception as e:
+            return None
+
+    async def list_storages(self):
+        """AList's mount table (admin API); None if unavailable or not permitted"""
+        try:
+            resp = await self._request("GET", "/api/admin/storage/list", params={"page": 1, "per_page": 0})
         except Exception as e:
+            logger.warning(f"Storage list error: {e}")
             return None
+        if not resp or resp.get('code') != 200:
+            logger.warning(f"Storage list refused: {resp and resp.get('message')}")
+            return None
+        return resp['data'].get('content') or []
 
     # --- File Management APIs ---
 
-    def fs_mkdir(self, path):
+    async def fs_mkdir(self, path):
         """Create directory"""
-        url = f"{self.host}/api/fs/mkdir"
         payload = {"path": path}
-        try:
-            r = requests.post(url, json=payload, headers=self.get_headers())
-            return r.json()
+        try: return await self._post("/api/fs/mkdir", payload, idempotent=False)
         except Exception as e: return {"code": 500, "message": str(e)}
+        finally: self.invalidate_dirs(_parent_dir(path))
 
-    def fs_rename(self, path, name):
+    async def fs_rename(self, path, name):
         """Rename file/folder"""
-        url = f"{self.host}/api/fs/rename"
         payload = {"path": path, "name": name}
-        try:
-            r = requests.post(url, json=payload, headers=self.get_headers())
-            return r.json()
+        try: return await self._post("/api/fs/rename", payload, idempotent=False)
         except Exception as e: return {"code": 500, "message": str(e)}
+        finally: self.invalidate_dirs(_parent_dir(path), path)
 
-    def fs_remove(self, names: list, dir_path: str):
+    async def fs_remove(self, names: list, dir_path: str):
         """Delete files/folders"""
-        url = f"{self.host}/api/fs/remove"
         payload = {"names": names, "dir": dir_path}
-        try:
-            r = requests.post(url, json=payload, headers=self.get_headers())
-            return r.json()
+        try: return await self._post("/api/fs/remove", payload, idempotent=False)
         except Exception as e: return {"code": 500, "message": str(e)}
+        finally: self.invalidate_dirs(dir_path, *(posixpath.join(dir_path, n) for n in names))
 
-    def fs_move_copy(self, src_dir, dst_dir, names: list, action="move"):
+    async def fs_move_copy(self, src_dir, dst_dir, names: list, action="move"):
         """Action: 'move' or 'copy'"""
-        url = f"{self.host}/api/fs/{action}"
         payload = {"src_dir": src_dir, "dst_dir": dst_dir, "names": names}
-        try:
-            r = requests.post(url, json=payload, headers=self.get_headers())
-            return r.json()
+        try: return await self._post(f"/api/fs/{action}", payload, idempotent=False)
+        except Exception as e: return {"code": 500, "message": str(e)}
+        finally: self.invalidate_dirs(src_dir, dst_dir, *(posixpath.join(src_dir, n) for n in names))
+
+    async def fs_batch_rename(self, src_dir, renames: dict):
+        """Rename several entries of one directory in one call ({old_name: new_name})"""
+        payload = {"src_dir": src_dir, "rename_objects": [{"src_name": o, "new_name": n} for o, n in renames.items()]}
+        try: return await self._post("/api/fs/batch_rename", payload, idempotent=False)
         except Exception as e: return {"code": 500, "message": str(e)}
+        finally: self.invalidate_dirs(src_dir, *(posixpath.join(src_dir, n) for n in renames))
 
 # Singleton
 alist_mgr = AListManager()
@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import logging
+import os
+from .config import (
+    AUDIO_COVER_SIZE, AUDIO_COVER_FPS, AUDIO_COVER_SECS, AUDIO_BITRATE_KBPS,
+    AUDIO_SAMPLE_RATE, COVER_CACHE_DIR
+)
+from .livestream import LiveStreamSession
+
+logger = logging.getLogger("AudioStream")
+
+async def _run_ffmpeg(cmd, env=None):
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE, env=env
+    )
+    _, err = await proc.communicate()
+    if proc.returncode != 0:
+        lines = err.decode('utf-8', errors='ignore').strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"ffmpeg code {proc.returncode}")
+
+async def render_cover(image=None, env=None):
+    """
+    Encode the cover (a resolved image entry, or plain black) once into a short
+    low-fps H.264 clip that the publisher loops with -c copy. Clips are cached
+    on disk by image path + size + modified + output settings.
+    """
+    w, _, h = AUDIO_COVER_SIZE.partition("x")
+    ident = f"{image['path']}|{image.get('size')}|{image.get('modified')}" if image else "black"
+    ident += f"|{AUDIO_COVER_SIZE}|{AUDIO_COVER_FPS}|{AUDIO_COVER_SECS}"
+    os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+    clip = os.path.join(COVER_CACHE_DIR, hashlib.sha1(ident.encode('utf-8')).hexdigest()[:16] + ".mp4")
+    if os.path.exists(clip): return clip
+
+    tmp_clip = f"{clip}.tmp.mp4"
+    still = f"{clip}.still.png"
+    try:
+        if image:
+            # Grab one frame locally first: -loop only works on image files, not HTTP streams
+            await _run_ffmpeg(["ffmpeg", "-y", "-loglevel", "error", "-i", image['url'], "-frames:v", "1", still], env)
+            source = ["-loop", "1", "-framerate", str(AUDIO_COVER_FPS), "-i", still]
+        else:
+            source = ["-f", "lavfi", "-i", f"color=c=black:s={w}x{h}:r={AUDIO_COVER_FPS}"]
+        await _run_ffmpeg([
+            "ffmpeg", "-y", "-loglevel", "error",
+            *source,
+            "-t", str(AUDIO_COVER_SECS),
+            "-vf", f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p",
+            "-r", str(AUDIO_COVER_FPS),
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+            "-g", str(AUDIO_COVER_FPS * 2), # Keyframe every 2s so viewers can join quickly
+            "-an", "-movflags", "+faststart",
+            tmp_clip
+        ], env)
+        os.replace(tmp_clip, clip)
+    finally:
+        for leftover in (tmp_clip, still):
+            if os.path.exists(leftover):
+                try: os.remove(leftover)
+                except OSError: pass
+    return clip
+
+class AudioStreamSession(LiveStreamSession):
+    """
+    Radio-style publisher: a pre-encoded cover clip looped forever as the video
+    track (stream copy, no per-frame work) plus the audio playlist. Each item
+    is decoded by its own feeder and encoded to AAC (MPEG-TS on the pipe), so
+    files with different codecs or sample rates can share one playlist; the
+    concat demuxer would cut out at the first codec change. Ends with the
+    audio (-shortest).
+    """
+    mode = 'audio'
+
+    def __init__(self, *args, cover_file, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cover_file = cover_file
+
+    def build_cmd(self):
+        return [
+            "ffmpeg",
+            "-re", "-stream_loop", "-1", "-i", self.cover_file,
+            "-fflags", "+genpts",
+            "-f", "mpegts",
+            "-i", "pipe:0",
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c", "copy",
+            "-shortest",
+            "-loglevel", "info",
+            "-progress", "pipe:1",
+            "-nostats",
+            *self.output_args(mapped=True)
+        ]
+
+    def needs_transcode(self, item):
+        return True # Every item is decoded; the publisher only copies
+
+    def build_feed_cmd(self, url, inpoint=0.0, item=None):
+        """One item's audio as real-time AAC in MPEG-TS, shifted to follow the previous item"""
+        cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-re"]
+        if inpoint > 0: cmd += ["-ss", f"{inpoint:.3f}"]
+        cmd += [
+            "-i", url,
+            "-map", "0:a:0", "-vn",
+            "-c:a", "aac", "-b:a", f"{AUDIO_BITRATE_KBPS}k", "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "2",
+            "-output_ts_offset", f"{self._ts_offset:.3f}",
+            "-progress", "pipe:2",
+            "-f", "mpegts",
+            "pipe:1"
+        ]
+        return cmd
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import posixpath
+import re
+from .accounts import alist_mgr
+from .config import BULK_CONCURRENCY, BULK_BATCH_SIZE
+from .resolver import link_cache
+
+logger = logging.getLogger("BulkOps")
+
+ACTION_LABELS = {'delete': "删除", 'move': "移动", 'copy': "复制", 'rename': "重命名"}
+
+def group_by_dir(paths):
+    """['/a/x', '/a/y', '/b/z'] -> {'/a': ['x', 'y'], '/b': ['z']} (order kept)"""
+    groups = {}
+    for path in paths:
+        groups.setdefault(posixpath.dirname(path) or "/", []).append(posixpath.basename(path))
+    return groups
+
+def parse_rename_rule(text):
+    """
+    'old => new' replaces literally, '/regex/ => new' with re.sub (\\1 etc. allowed).
+    Returns a name -> new name function; raises ValueError on a bad rule.
+    """
+    find, sep, repl = text.partition("=>")
+    find, repl = find.strip(), repl.strip()
+    if not sep or not find:
+        raise ValueError("格式应为: 查找内容 => 替换为")
+    if len(find) > 2 and find.startswith("/") and find.endswith("/"):
+        try: pattern = re.compile(find[1:-1])
+        except re.error as e: raise ValueError(f"正则无效: {e}")
+        return lambda name: pattern.sub(repl, name)
+    return lambda name: name.replace(find, repl)
+
+class BulkResult:
+    def __init__(self, action):
+        self.action = action
+        self.done = [] # Paths the action succeeded on
+        self.failed = [] # (dir, names, reason)
+        self.skipped = [] # (path, reason)
+
+    def summary(self):
+        label = ACTION_LABELS[self.action]
+        dirs = len({posixpath.dirname(p) for p in self.done})
+        lines = [f"✅ 已{label} {len(self.done)} 项 (涉及 {dirs} 个目录)"]
+        if self.skipped:
+            lines.append(f"⏭ 跳过 {len(self.skipped)} 项:")
+            lines += [f"  • {posixpath.basename(p)}: {why}" for p, why in self.skipped[:5]]
+            if len(self.skipped) > 5: lines.append(f"  … 另有 {len(self.skipped) - 5} 项")
+        if self.failed:
+            count = sum(len(names) for _, names, _ in self.failed)
+            lines.append(f"❌ 失败 {count} 项:")
+            lines += [f"  • {d} ({len(names)} 项): {why}" for d, names, why in self.failed[:5]]
+            if len(self.failed) > 5: lines.append(f"  … 另有 {len(self.failed) - 5} 组")
+        return "\n".join(lines)
+
+def _plan(action, paths, dst_dir=None, rename=None):
+    """Split the selection into per-directory batches: [(dir, names, renames)], plus skips"""
+    batches, skipped = [], []
+    dst = (dst_dir or "/").rstrip('/') or "/"
+    for src_dir, names in group_by_dir(paths).items():
+        renames = None
+        if action in ('move', 'copy') and src_dir == dst:
+            skipped += [(posixpath.join(src_dir, n), "已在目标目录") for n in names]
+            continue
+        if action == 'rename':
+            renames, taken = {}, set(names)
+            for name in names:
+                new = rename(name).strip()
+                if new == name: skipped.append((posixpath.join(src_dir, name), "名称未变化"))
+                elif not new or "/" in new: skipped.append((posixpath.join(src_dir, name), f"新名称无效: {new!r}"))
+                elif new in taken: skipped.append((posixpath.join(src_dir, name), f"重名: {new}"))
+                else:
+                    renames[name] = new
+                    taken.add(new)
+            names = list(renames)
+        for i in range(0, len(names), BULK_BATCH_SIZE):
+            chunk = names[i:i + BULK_BATCH_SIZE]
+            batches.append((src_dir, chunk, {n: renames[n] for n in chunk} if renames is not None else None))
+    return batches, skipped
+
+async def _apply(action, src_dir, names, renames, dst_dir):
+    if action == 'delete': return await alist_mgr.fs_remove(names, src_dir)
+    if action in ('move', 'copy'): return await alist_mgr.fs_move_copy(src_dir, dst_dir, names, action=action)
+    return await alist_mgr.fs_batch_rename(src_dir, renames)
+
+async def run_bulk(action, paths, dst_dir=None, rename=None, concurrency=BULK_CONCURRENCY, on_progress=None):
+    """
+    Apply `action` ('delete', 'move', 'copy', 'rename') to AList paths with one
+    call per directory (split every BULK_BATCH_SIZE names), at most
+    `concurrency` calls in flight. `on_progress(done, total)` is awaited per call.
+    """
+    result = BulkResult(action)
+    batches, result.skipped = _plan(action, paths, dst_dir, rename)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    total = len(batches)
+    done = 0
+
+    async def worker(src_dir, names, renames):
+        nonlocal done
+        async with sem:
+            resp = await _apply(action, src_dir, names, renames, dst_dir)
+        if resp and resp.get('code') == 200:
+            for name in names:
+                path = posixpath.join(src_dir, name)
+                result.done.append(path)
+                if action != 'copy': link_cache.invalidate(path) # The old path no longer exists
+        else:
+            reason = (resp or {}).get('message') or "AList 无响应"
+            logger.warning(f"Bulk {action} in {src_dir} failed: {reason}")
+            result.failed.append((src_dir, names, reason))
+        done += 1
+        if on_progress:
+            try: await on_progress(done, total)
+            except Exception: pass
+
+    await asyncio.gather(*(worker(*b) for b in batches))
+    return result
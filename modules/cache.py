@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from .config import (
+    LIST_CACHE_TTL, LIST_CACHE_STALE, LIST_CACHE_MAX_ENTRIES,
+    LIST_CACHE_MAX_BYTES, LIST_CACHE_SWEEP_INTERVAL
+)
+
+logger = logging.getLogger("Cache")
+
+def estimate_size(value):
+    """Approximate memory footprint of a JSON-like value in bytes"""
+    try: return len(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+    except (TypeError, ValueError): return 1024
+
+class LRUCache:
+    """
+    Bounded LRU cache with an entry and byte budget.
+    Each entry is fresh for `ttl` seconds, then servable as stale for another
+    `stale_ttl` seconds (stale-while-revalidate), then dropped.
+    """
+    def __init__(self, max_entries, max_bytes, ttl, stale_ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict() # key -> (value, size, fresh_until, stale_until)
+        self._bytes = 0
+        self._sweeper = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _drop(self, key):
+        value, size, _, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def lookup(self, key):
+        """Return (value, is_stale); (None, False) on miss"""
+        hit = self._data.get(key)
+        now = time.time()
+        if hit is None or now >= hit[3]:
+            if hit is not None: self._drop(key)
+            self.misses += 1
+            return None, False
+        self._data.move_to_end(key)
+        if now >= hit[2]:
+            self.stale_hits += 1
+            return hit[0], True
+        self.hits += 1
+        return hit[0], False
+
+    def get(self, key):
+        """Fresh value or None"""
+        value, stale = self.lookup(key)
+        return None if stale else value
+
+    def peek(self, key):
+        """Fresh value or None, without counting a hit/miss or touching LRU order"""
+        hit = self._data.get(key)
+        return hit[0] if hit is not None and time.time() < hit[2] else None
+
+    def set(self, key, value, ttl=None, size=None):
+        ttl = self.ttl if ttl is None else ttl
+        size = estimate_size(value) if size is None else size
+        if key in self._data: self._drop(key) # Also when the new value is too big: never keep serving the old one
+        if size > self.max_bytes: return
+        now = time.time()
+        self._data[key] = (value, size, now + ttl, now + ttl + self.stale_ttl)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def delete(self, key):
+        if key in self._data: self._drop(key)
+
+    def invalidate(self, predicate):
+        """Drop every entry whose key matches predicate(key)"""
+        for key in [k for k in self._data if predicate(k)]:
+            self._drop(key)
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def sweep(self):
+        """Remove entries past their stale window"""
+        now = time.time()
+        expired = [k for k, (_, _, _, stale_until) in self._data.items() if now >= stale_until]
+        for key in expired: self._drop(key)
+        return len(expired)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+    # --- Background Sweeper ---
+
+    def start_sweeper(self, interval=LIST_CACHE_SWEEP_INTERVAL):
+        if self._sweeper and not self._sweeper.done(): return
+        self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try: await self._sweeper
+            except asyncio.CancelledError: pass
+            self._sweeper = None
+
+    async def _sweep_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"Swept {removed} expired entries, stats={self.stats()}")
+
+# Directory listings: key = (path, page, per_page)
+listing_cache = LRUCache(
+    max_entries=LIST_CACHE_MAX_ENTRIES,
+    max_bytes=LIST_CACHE_MAX_BYTES,
+    ttl=LIST_CACHE_TTL,
+    stale_ttl=LIST_CACHE_STALE
+)
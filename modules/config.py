@@ -1,7 +1,6 @@
 
 import os
 import logging
-import time
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -14,12 +13,130 @@ else: load_dotenv()
 # Constants
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = os.getenv("ADMIN_ID")
-WEB_PORT = 8080
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))  # Updates handled in parallel (1 = one at a time)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")  # Or a local Bot API server
+
+# Webhook Mode (instead of long polling)
+WEBHOOK_ENABLED = os.getenv("WEBHOOK_ENABLED", "0") == "1"
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")                 # Bound on WEB_PORT
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                                    # Public base URL Telegram posts to
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")                              # Derived from BOT_TOKEN if unset
 
 # AList Config
 ALIST_HOST = os.getenv("ALIST_HOST", "http://127.0.0.1:5244")
 ALIST_USER = os.getenv("ALIST_USER", "admin")
 ALIST_PASS = os.getenv("ALIST_PASS", "123456")
+ALIST_TIMEOUT = float(os.getenv("ALIST_TIMEOUT", "15"))     # Per-call timeout (seconds)
+ALIST_RETRIES = int(os.getenv("ALIST_RETRIES", "2"))        # Retries on transport errors
+ALIST_POOL_SIZE = int(os.getenv("ALIST_POOL_SIZE", "8"))    # Max pooled keep-alive connections
+ALIST_TOKEN_REFRESH_MARGIN = int(os.getenv("ALIST_TOKEN_REFRESH_MARGIN", "300"))  # Re-login this long before the JWT expires
+
+# Link Resolution
+RESOLVE_CONCURRENCY = int(os.getenv("RESOLVE_CONCURRENCY", "6"))  # Parallel /api/fs/get calls
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", "1800"))         # Max lifetime of a cached raw_url
+LOCAL_FASTPATH = os.getenv("LOCAL_FASTPATH", "1") == "1"           # Read files on Local storages from disk
+LOCAL_MOUNTS_TTL = int(os.getenv("LOCAL_MOUNTS_TTL", "600"))       # Re-read AList's storage table this often
+
+# Directory Listing Cache
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", "60"))                    # Fresh window (seconds)
+LIST_CACHE_STALE = int(os.getenv("LIST_CACHE_STALE", "600"))               # Served stale while refreshing
+LIST_CACHE_MAX_ENTRIES = int(os.getenv("LIST_CACHE_MAX_ENTRIES", "256"))
+LIST_CACHE_MAX_BYTES = int(os.getenv("LIST_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+LIST_CACHE_SWEEP_INTERVAL = int(os.getenv("LIST_CACHE_SWEEP_INTERVAL", "30"))
+
+# File Browser
+BROWSE_PAGE_SIZE = int(os.getenv("BROWSE_PAGE_SIZE", "20"))   # Entries per AList page
+
+# Telegram Message Edits (coalescing + flood control)
+EDIT_MIN_INTERVAL = float(os.getenv("EDIT_MIN_INTERVAL", "0.5"))  # Edits of one message closer than this are merged
+EDIT_CHAT_RATE = float(os.getenv("EDIT_CHAT_RATE", "1"))          # Sustained edits per second per chat
+EDIT_CHAT_BURST = int(os.getenv("EDIT_CHAT_BURST", "3"))          # Edits a chat may burst above that rate
+EDIT_GLOBAL_RATE = float(os.getenv("EDIT_GLOBAL_RATE", "25"))     # Bot-wide edits per second (Telegram: ~30 msg/s)
+
+# Recursive Folder Add
+WALK_CONCURRENCY = int(os.getenv("WALK_CONCURRENCY", "4"))     # Parallel /api/fs/list calls
+WALK_MAX_DEPTH = int(os.getenv("WALK_MAX_DEPTH", "5"))         # Levels below the chosen folder
+WALK_MAX_FILES = int(os.getenv("WALK_MAX_FILES", "1000"))      # Matching files collected at most
+WALK_MAX_DIRS = int(os.getenv("WALK_MAX_DIRS", "500"))         # Folders listed at most
+WALK_PAGE_SIZE = 200
+
+# Bulk File Operations
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "3"))     # Directories processed at once
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "200"))     # Names per AList call
+
+# Streaming
+KEYS_FILE = os.getenv("KEYS_FILE", "stream_keys.json")                     # Saved stream keys
+STREAMS_DIR = os.getenv("STREAMS_DIR", str(current_dir / "streams"))       # Per-session logs/playlists
+MAX_CONCURRENT_STREAMS = int(os.getenv("MAX_CONCURRENT_STREAMS", "3"))     # ffmpeg publishers at once
+MAX_TOTAL_EGRESS_KBPS = int(os.getenv("MAX_TOTAL_EGRESS_KBPS", "20000"))   # Summed upload budget
+STREAM_EST_KBPS = int(os.getenv("STREAM_EST_KBPS", "4000"))                # Assumed bitrate until measured
+STREAM_QUEUE_MAX = int(os.getenv("STREAM_QUEUE_MAX", "3"))                 # Sessions waiting for capacity
+STREAM_STOP_TIMEOUT = float(os.getenv("STREAM_STOP_TIMEOUT", "5"))  # Grace period before SIGKILL
+STATUS_REFRESH_INTERVAL = int(os.getenv("STATUS_REFRESH_INTERVAL", "5"))    # Auto-refresh period
+STATUS_REFRESH_DURATION = int(os.getenv("STATUS_REFRESH_DURATION", "600"))  # Auto-refresh stops after
+
+# Stream Watchdog (auto-restart dead or stalled ffmpeg)
+WATCHDOG_ENABLED = os.getenv("WATCHDOG_ENABLED", "1") == "1"
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "5"))         # Health check period
+WATCHDOG_STALL_SECS = int(os.getenv("WATCHDOG_STALL_SECS", "30"))      # out_time frozen this long = stall
+WATCHDOG_MIN_SPEED = float(os.getenv("WATCHDOG_MIN_SPEED", "0.8"))     # Below this speed ...
+WATCHDOG_SLOW_SECS = int(os.getenv("WATCHDOG_SLOW_SECS", "60"))        # ... for this long = stall
+WATCHDOG_STABLE_SECS = int(os.getenv("WATCHDOG_STABLE_SECS", "120"))   # Healthy run resets the backoff
+WATCHDOG_MAX_RESTARTS = int(os.getenv("WATCHDOG_MAX_RESTARTS", "5"))   # Restart budget ...
+WATCHDOG_WINDOW = int(os.getenv("WATCHDOG_WINDOW", "3600"))            # ... per this many seconds
+WATCHDOG_BACKOFF = float(os.getenv("WATCHDOG_BACKOFF", "2"))           # First restart delay, doubles
+WATCHDOG_BACKOFF_MAX = float(os.getenv("WATCHDOG_BACKOFF_MAX", "60"))
+
+# Stream Logs
+LOG_RING_BYTES = int(os.getenv("LOG_RING_BYTES", str(512 * 1024)))         # In-memory tail per session
+LOG_DOWNLOAD_BYTES = int(os.getenv("LOG_DOWNLOAD_BYTES", str(256 * 1024))) # "Download log" window
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(2 * 1024 * 1024))) # Rotate on-disk log at
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "3"))                           # Compressed segments kept
+
+# Media Probe (ffprobe)
+PROBE_ENABLED = os.getenv("PROBE_ENABLED", "1") == "1"
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "3"))          # ffprobe processes at once
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "20"))               # Per file, over the network
+PROBE_CACHE_FILE = os.getenv("PROBE_CACHE_FILE", str(current_dir / "probe_cache.json"))
+PROBE_CACHE_MAX_ENTRIES = int(os.getenv("PROBE_CACHE_MAX_ENTRIES", "5000"))
+
+# Compatibility Mode (copy matching files, transcode the rest)
+TARGET_PROFILE = os.getenv("TARGET_PROFILE", "auto")          # auto = playlist's dominant format when usable
+TARGET_WIDTH = int(os.getenv("TARGET_WIDTH", "1280"))
+TARGET_HEIGHT = int(os.getenv("TARGET_HEIGHT", "720"))
+TARGET_FPS = float(os.getenv("TARGET_FPS", "30"))
+TARGET_VIDEO_KBPS = int(os.getenv("TARGET_VIDEO_KBPS", "2500"))
+TARGET_AUDIO_KBPS = int(os.getenv("TARGET_AUDIO_KBPS", "128"))
+TARGET_AUDIO_RATE = int(os.getenv("TARGET_AUDIO_RATE", "44100"))
+TRANSCODE_PRESET = os.getenv("TRANSCODE_PRESET", "veryfast")  # x264 preset for outliers
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "0"))  # 0 = derive from CPU count
+
+# Audio Live (static cover + audio playlist)
+AUDIO_COVER_SIZE = os.getenv("AUDIO_COVER_SIZE", "1280x720")
+AUDIO_COVER_FPS = int(os.getenv("AUDIO_COVER_FPS", "2"))       # Still image needs very few frames
+AUDIO_COVER_SECS = int(os.getenv("AUDIO_COVER_SECS", "10"))    # Length of the looped clip
+AUDIO_BITRATE_KBPS = int(os.getenv("AUDIO_BITRATE_KBPS", "128"))
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "44100"))
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", os.path.join(STREAMS_DIR, "_covers"))
+
+# Read-ahead Relay (ffmpeg <- local HTTP <- AList/storage)
+RELAY_ENABLED = os.getenv("RELAY_ENABLED", "1") == "1"
+RELAY_HOST = os.getenv("RELAY_HOST", "127.0.0.1")
+RELAY_PORT = int(os.getenv("RELAY_PORT", "0"))                           # 0 = any free port
+RELAY_BUFFER_BYTES = int(os.getenv("RELAY_BUFFER_BYTES", str(8 * 1024 * 1024)))  # Read-ahead per stream
+RELAY_CHUNK = 64 * 1024
+RELAY_RETRIES = int(os.getenv("RELAY_RETRIES", "5"))                     # Range resumes per stream
+RELAY_READ_TIMEOUT = float(os.getenv("RELAY_READ_TIMEOUT", "20"))        # Upstream silent this long = reconnect
+RELAY_PREOPEN_TTL = float(os.getenv("RELAY_PREOPEN_TTL", "60"))          # Unused pre-opened next item is dropped this long after the current one ends
+
+# Media Cache (local copies of replayed files)
+MEDIA_CACHE_ENABLED = os.getenv("MEDIA_CACHE_ENABLED", "0") == "1"
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", str(current_dir / "media_cache"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))     # Disk budget
+MEDIA_CACHE_MAX_FILE_BYTES = int(os.getenv("MEDIA_CACHE_MAX_FILE_BYTES", str(MEDIA_CACHE_MAX_BYTES // 4)))
+MEDIA_CACHE_DOWNLOADS = int(os.getenv("MEDIA_CACHE_DOWNLOADS", "1"))    # Background downloads at once
 
 # Proxy Support
 HTTP_PROXY = os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
@@ -32,29 +149,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Bot")
 
-# --- Simple Memory Cache ---
-class SimpleCache:
-    def __init__(self):
-        self._cache = {}
-
-    def get(self, key):
-        if key in self._cache:
-            data, expiry = self._cache[key]
-            if time.time() < expiry:
-                return data
-            else:
-                del self._cache[key]
-        return None
-
-    def set(self, key, value, ttl=300): # Default 5 mins
-        self._cache[key] = (value, time.time() + ttl)
-
-    def clear(self):
-        self._cache.clear()
-
-# Global Cache Instance
-global_cache = SimpleCache()
-
 # Auth Helper
 async def check_auth(update, context) -> bool:
     if not update.effective_user: return False
@@ -1,15 +1,17 @@
 
 import urllib.parse
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 from telegram.ext import ContextTypes
 from .accounts import alist_mgr
-from .utils import format_bytes
+from .config import BROWSE_PAGE_SIZE, WALK_MAX_FILES, WALK_MAX_DEPTH
+from .playlist import get_playlist
+from .bulkops import ACTION_LABELS, group_by_dir, parse_rename_rule, run_bulk
+from .utils import natural_key, VIDEO_EXTS, AUDIO_EXTS, IMAGE_EXTS
+from .handlers_task import live_session_for
+from .msgedit import edit_message
 
-# --- Constants ---
-VIDEO_EXTS = ('.mp4', '.mkv', '.avi', '.mov', '.flv', '.webm', '.ts', '.m2ts')
-AUDIO_EXTS = ('.mp3', '.flac', '.wav', '.m4a', '.aac', '.ogg', '.wma')
-IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
 
 def is_target_file(filename, mode):
     lower_name = filename.lower()
@@ -19,28 +21,37 @@ def is_target_file(filename, mode):
         return lower_name.endswith(AUDIO_EXTS) or lower_name.endswith(IMAGE_EXTS)
     return True
 
+def parse_ls_callback(data):
+    """'ls:<path>' or 'ls:<page>:<path>' -> (path, page)"""
+    rest = data[3:]
+    head, sep, tail = rest.partition(":")
+    if sep and head.isdigit():
+        return tail or "/", int(head)
+    return rest or "/", 1
+
 # --- File Browser with Multi-Select ---
 async def show_alist_files(update: Update, context: ContextTypes.DEFAULT_TYPE, path="/", page=1, edit_msg=False):
     if path == "": path = "/"
     
-    # Store current path for refreshing
-    context.user_data['current_path'] = path
-    
     # Get Browse Mode
     mode = context.user_data.get('browse_mode', 'video') # default video
-    playlist = context.user_data.get('playlist', [])
-    playlist_count = len(playlist)
 
     # Fetch Data
-    resp = alist_mgr.list_files(path, page=page)
+    resp = await alist_mgr.list_files(path, page=page, per_page=BROWSE_PAGE_SIZE)
     if not resp or resp.get('code') != 200:
         msg = "❌ 无法连接 AList"
-        if edit_msg: await update.callback_query.edit_message_text(msg)
+        if edit_msg: await edit_message(update.callback_query.message, msg)
         else: await context.bot.send_message(update.effective_chat.id, msg)
         return
 
     data = resp['data']
-    content = data.get('content', [])
+    content = data.get('content') or []
+    total = data.get('total') or 0
+    total_pages = max(1, (total + BROWSE_PAGE_SIZE - 1) // BROWSE_PAGE_SIZE)
+
+    # Prefetch next page so paging forward is instant
+    if page < total_pages:
+        alist_mgr.prefetch_list(path, page + 1, per_page=BROWSE_PAGE_SIZE)
     
     # Filter Content based on Mode
     filtered_content = []
@@ -50,20 +61,49 @@ async def show_alist_files(update: Update, context: ContextTypes.DEFAULT_TYPE, p
         elif is_target_file(item['name'], mode):
             filtered_content.append(item)
 
-    # Sort: Folders first
-    filtered_content.sort(key=lambda x: (not x['is_dir'], x['name']))
+    # Sort: Folders first. Page boundaries follow AList's own order and
+    # filtering happens after paging, so an entry always lives on the same page.
+    filtered_content.sort(key=lambda x: (not x['is_dir'], natural_key(x['name'])))
+
+    # Store the current view; selection callbacks are 'sel:<index>' into this list
+    # (Telegram caps callback data at 64 bytes, too small for full paths)
+    context.user_data['current_path'] = path
+    context.user_data['current_page'] = page
+    context.user_data['current_total'] = total
+    context.user_data['current_file_list'] = filtered_content
+
+    await render_file_list(update, context, edit_msg=edit_msg)
+
+async def render_file_list(update, context, edit_msg=True):
+    """Build the browser UI from the stored view without touching AList"""
+    path = context.user_data.get('current_path', '/')
+    page = context.user_data.get('current_page', 1)
+    total = context.user_data.get('current_total', 0)
+    filtered_content = context.user_data.get('current_file_list', [])
+    total_pages = max(1, (total + BROWSE_PAGE_SIZE - 1) // BROWSE_PAGE_SIZE)
+
+    mode = context.user_data.get('browse_mode', 'video')
+    playlist = get_playlist(context.user_data)
+    playlist_count = len(playlist)
 
     keyboard = []
     
-    # 1. Info & Control Row
+    # 1. Control Row
     mode_icon = "🎬" if mode == 'video' else "🎵"
-    info_text = f"{mode_icon} 已选: {playlist_count} 个文件"
     
     control_row = []
     if playlist_count > 0:
         control_row.append(InlineKeyboardButton(f"▶️ 开始推流 ({playlist_count})", callback_data="action_start_stream"))
         control_row.append(InlineKeyboardButton("🗑 清空", callback_data="action_clear_playlist"))
+        control_row.append(InlineKeyboardButton("🛠 批量操作", callback_data="bulk_menu"))
     keyboard.append(control_row)
+    if playlist_count > 0 and mode == 'video': # Audio mode has its own cover + AAC engine
+        keyboard.append([
+            InlineKeyboardButton("📡 无缝直播", callback_data="action_start_live"),
+            InlineKeyboardButton("🧩 兼容模式", callback_data="action_start_adaptive")
+        ])
+    if playlist_count > 0 and live_session_for(context):
+        keyboard.append([InlineKeyboardButton(f"➕ 追加到直播 ({playlist_count})", callback_data="action_live_append")])
 
     # 2. Navigation Row
     nav_row = []
@@ -73,81 +113,40 @@ async def show_alist_files(update: Update, context: ContextTypes.DEFAULT_TYPE, p
         nav_row.append(InlineKeyboardButton("🔙 上一级", callback_data=f"ls:{parent}"))
     
     nav_row.append(InlineKeyboardButton("🏠 首页", callback_data="ls:/"))
+    nav_row.append(InlineKeyboardButton("➕ 添加整个文件夹", callback_data="action_add_folder"))
     keyboard.append(nav_row)
 
     # 3. File List
-    for item in filtered_content:
-        name = item['name']
-        is_dir = item['is_dir']
-        full_path = os.path.join(path, name).replace("\\", "/")
-        
-        display_name = (name[:25] + '..') if len(name) > 25 else name
-        
-        if is_dir:
-            keyboard.append([
-                InlineKeyboardButton(f"📁 {display_name}", callback_data=f"ls:{full_path}")
-            ])
-        else:
-            # Check if selected
-            # Store simplified items in playlist: {'path': full_path, 'name': name}
-            is_selected = any(p['path'] == full_path for p in playlist)
-            check_icon = "✅" if is_selected else "⬜"
-            
-            # Use a safe way to encode path for callback data
-            # Callback data limit is 64 bytes. If path is long, this fails.
-            # Strategy: We can't put full path in callback if deep.
-            # BUT for this bot, we assume paths aren't crazy deep or we use a cache map.
-            # For robustness in "Lite" version, we try direct path if short, otherwise we might have issues.
-            # Let's strip the common prefix or use an index if we cached the list.
-            # Simpler approach: Just put the index of the item in the current filtered_content list?
-            # No, that breaks if list changes.
-            # Let's use urllib quote but be wary of length.
-            
-            # Workaround: Use a temporary index for the current view? 
-            # Ideally we need a session-based map.
-            # Let's stick to 'sel:<index>' relative to the CURRENT page content.
-            # We need to save 'current_view_files' in user_data.
-            
-            size = format_bytes(item['size'])
-            keyboard.append([InlineKeyboardButton(f"{check_icon} {display_name} ({size})", callback_data=f"sel:{full_path}")])
-
-    # Save content map for safer callbacks? 
-    # Actually, let's just use the full path. If it fails, user will know.
-    # Telegram limit is 64 bytes. This is very small.
-    # We MUST use a mapping.
-    
-    # Mapping Strategy:
-    # Key: Hash(path) -> Value: Path. 
-    # Or simpler: Just rely on the user clicking and us finding it?
-    # No, we need to know what they clicked.
-    # Let's try passing the index in the `filtered_content` array.
-    # We must save `filtered_content` to user_data.
-    context.user_data['current_file_list'] = filtered_content
-    
-    # Re-generate keyboard using indices
-    keyboard = [keyboard[0], keyboard[1]] # Keep control and nav rows
-    
     for idx, item in enumerate(filtered_content):
         name = item['name']
-        is_dir = item['is_dir']
         display_name = (name[:25] + '..') if len(name) > 25 else name
+        full_path = os.path.join(path, name).replace("\\", "/")
         
-        if is_dir:
-            full_path = os.path.join(path, name).replace("\\", "/")
+        if item['is_dir']:
             keyboard.append([InlineKeyboardButton(f"📁 {display_name}", callback_data=f"ls:{full_path}")])
         else:
-            full_path = os.path.join(path, name).replace("\\", "/")
-            is_selected = any(p['path'] == full_path for p in playlist)
-            check_icon = "✅" if is_selected else "⬜"
-            # Pass index
+            check_icon = "✅" if full_path in playlist else "⬜"
             keyboard.append([InlineKeyboardButton(f"{check_icon} {display_name}", callback_data=f"sel:{idx}")])
 
+    # 4. Paging Row
+    if total_pages > 1:
+        page_row = []
+        if page > 1:
+            page_row.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"ls:{page - 1}:{path}"))
+        page_row.append(InlineKeyboardButton(f"📄 {page}/{total_pages}", callback_data=f"ls:{page}:{path}"))
+        if page < total_pages:
+            page_row.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"ls:{page + 1}:{path}"))
+        keyboard.append(page_row)
+
     text = f"📂 **选择文件** ({mode_icon})\n路径: `{path}`"
+    if total_pages > 1:
+        text += f"\n第 {page}/{total_pages} 页 (共 {total} 项)"
+    if not filtered_content:
+        text += "\n_(本页无匹配文件)_"
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     if edit_msg:
-        try: await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-        except: pass
+        await edit_message(update.callback_query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
     else:
         await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup, parse_mode='Markdown')
 
@@ -162,25 +161,148 @@ async def handle_file_selection(update, context, data):
             current_path = context.user_data.get('current_path', '/')
             full_path = os.path.join(current_path, item['name']).replace("\\", "/")
             
-            playlist = context.user_data.get('playlist', [])
-            
-            # Toggle Logic
-            # Check if exists
-            existing = next((i for i, p in enumerate(playlist) if p['path'] == full_path), None)
+            # Toggle Logic (O(1) on the path index)
+            get_playlist(context.user_data).toggle(full_path, item['name'])
             
-            if existing is not None:
-                # Remove
-                playlist.pop(existing)
-            else:
-                # Add
-                playlist.append({'path': full_path, 'name': item['name']})
-            
-            context.user_data['playlist'] = playlist
-            
-            # Refresh View (Fast refresh without fetching API if possible, but API fetch ensures consistency)
-            # To be safe, we just reload the UI.
-            await show_alist_files(update, context, path=current_path, edit_msg=True)
+            # Re-render from the stored view, no AList round trip
+            await render_file_list(update, context, edit_msg=True)
             
     except Exception as e:
         print(f"Selection Error: {e}")
         await update.callback_query.answer("选择出错，请刷新")
+
+async def add_folder_recursive(update, context):
+    """Walk the current folder tree and append every matching file to the playlist"""
+    query = update.callback_query
+    root = context.user_data.get('current_path', '/')
+    mode = context.user_data.get('browse_mode', 'video')
+    playlist = get_playlist(context.user_data)
+
+    await edit_message(query.message, f"⏳ 正在扫描 `{root}` ...", parse_mode='Markdown')
+
+    found = []
+    last_edit = time.monotonic()
+    async for full_path, item in alist_mgr.walk_files(root, predicate=lambda i: is_target_file(i['name'], mode)):
+        found.append({'path': full_path, 'name': item['name']})
+        now = time.monotonic()
+        if now - last_edit >= 1.0:
+            last_edit = now
+            await edit_message(query.message, f"⏳ 正在扫描 `{root}` ...\n已找到 {len(found)} 个文件", parse_mode='Markdown')
+
+    found.sort(key=lambda f: natural_key(f['path']))
+    added = playlist.extend(found)
+
+    note = ""
+    if len(found) >= WALK_MAX_FILES:
+        note = f"\n⚠️ 已达到上限 {WALK_MAX_FILES} 个文件 (最大深度 {WALK_MAX_DEPTH} 层)，其余文件未添加。"
+    await context.bot.send_message(
+        update.effective_chat.id,
+        f"✅ 已添加 {added} 个文件 (扫描到 {len(found)} 个，跳过 {len(found) - added} 个已选)。{note}"
+    )
+    await render_file_list(update, context, edit_msg=True)
+
+# --- Bulk File Operations (on the current selection) ---
+
+async def show_bulk_menu(update, context):
+    query = update.callback_query
+    playlist = get_playlist(context.user_data)
+    if not playlist:
+        await query.answer("未选择任何文件", show_alert=True)
+        return await render_file_list(update, context, edit_msg=True)
+    path = context.user_data.get('current_path', '/')
+    dirs = len(group_by_dir(item['path'] for item in playlist))
+    text = (
+        f"🛠 **批量操作**\n已选 {len(playlist)} 项，分布在 {dirs} 个目录\n"
+        f"当前目录: `{path}`\n\n移动/复制的目标为当前目录，可先浏览到目标目录再操作。"
+    )
+    keyboard = [
+        [InlineKeyboardButton("🗑 删除", callback_data="bulk_confirm_delete"),
+         InlineKeyboardButton("✏️ 重命名", callback_data="bulk_rename")],
+        [InlineKeyboardButton("✂️ 移动到当前目录", callback_data="bulk_do:move"),
+         InlineKeyboardButton("📋 复制到当前目录", callback_data="bulk_do:copy")],
+        [InlineKeyboardButton("🔙 返回", callback_data="bulk_back")]
+    ]
+    await edit_message(query.message, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def handle_bulk_action(update, context):
+    query = update.callback_query
+    data = query.data
+    if data == "bulk_menu":
+        await show_bulk_menu(update, context)
+    elif data == "bulk_back":
+        await render_file_list(update, context, edit_msg=True)
+    elif data == "bulk_confirm_delete":
+        count = len(get_playlist(context.user_data))
+        keyboard = [[
+            InlineKeyboardButton(f"⚠️ 确认删除 {count} 项", callback_data="bulk_do:delete"),
+            InlineKeyboardButton("取消", callback_data="bulk_menu")
+        ]]
+        await edit_message(query.message, f"确定要从 AList 删除所选的 {count} 项吗？此操作不可恢复。", reply_markup=InlineKeyboardMarkup(keyboard))
+    elif data == "bulk_rename":
+        context.user_data['input_mode'] = 'bulk_rename'
+        await query.message.reply_text(
+            f"✏️ 批量重命名 {len(get_playlist(context.user_data))} 项，请发送规则:\n"
+            "`查找内容 => 替换为` (普通替换)\n"
+            "`/正则/ => 替换为` (正则，可用 \\1 引用分组)\n"
+            "例如: `.1080p => ` 或 `/^(\\d+)/ => EP\\1`",
+            parse_mode='Markdown',
+            reply_markup=ForceReply(selective=True)
+        )
+    elif data.startswith("bulk_do:"):
+        action = data.split(":", 1)[1]
+        if action in ACTION_LABELS:
+            await run_bulk_action(update, context, action)
+
+async def process_rename_input(update, context):
+    del context.user_data['input_mode']
+    try:
+        rule = parse_rename_rule(update.message.text)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    await run_bulk_action(update, context, 'rename', rename=rule)
+
+async def run_bulk_action(update, context, action, rename=None):
+    """Run a bulk action on the selection with a progress message, then refresh the listing"""
+    query = update.callback_query
+    chat_id = update.effective_chat.id
+    playlist = get_playlist(context.user_data)
+    paths = [item['path'] for item in playlist]
+    if not paths:
+        await context.bot.send_message(chat_id, "⚠️ 未选择任何文件")
+        return
+    path = context.user_data.get('current_path', '/')
+    page = context.user_data.get('current_page', 1)
+    label = ACTION_LABELS[action]
+
+    text = f"⏳ 正在{label} {len(paths)} 项..."
+    if query:
+        status = query.message
+        await edit_message(query.message, text)
+    else:
+        status = await context.bot.send_message(chat_id, text)
+
+    last_edit = time.monotonic()
+    async def on_progress(done, total):
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < 1.0 and done < total: return
+        last_edit = now
+        await edit_message(status, f"⏳ 正在{label} {len(paths)} 项... ({done}/{total} 批)")
+
+    result = await run_bulk(action, paths, dst_dir=path, rename=rename, on_progress=on_progress)
+
+    # Moved, renamed or deleted paths are gone; a copy leaves the originals selected
+    if action != 'copy':
+        for done_path in result.done: playlist.remove(done_path)
+
+    summary = result.summary()
+    if action in ('move', 'copy') and result.done:
+        summary += "\nℹ️ 跨存储的移动/复制由 AList 后台任务完成，目标目录可能稍后才显示全部文件。"
+    if query:
+        await context.bot.send_message(chat_id, summary)
+        await show_alist_files(update, context, path=path, page=page, edit_msg=True)
+    else:
+        try: await edit_message(status, summary, wait=True)
+        except Exception: await context.bot.send_message(chat_id, summary)
+        await show_alist_files(update, context, path=path, page=page)
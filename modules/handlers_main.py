@@ -2,18 +2,30 @@
 import logging
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
-from .config import check_auth, global_cache
+from .config import check_auth
 from .handlers_file import (
     show_alist_files, 
-    handle_file_selection
+    render_file_list,
+    handle_file_selection,
+    add_folder_recursive,
+    parse_ls_callback,
+    handle_bulk_action,
+    process_rename_input
 )
+from .playlist import Playlist, get_playlist
+from .locks import user_locks
 from .handlers_task import (
     show_stream_status,
+    toggle_status_autorefresh,
+    parse_sid,
     stop_stream, 
+    stop_all_streams,
     handle_stream_key_action,
     process_stream_input,
     show_key_manager,
     start_playlist_stream,
+    append_to_live,
+    handle_live_queue_action,
     view_stream_log
 )
 
@@ -44,7 +56,10 @@ async def router_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_auth(update, context): return
     msg = update.message.text.strip()
     
-    # 1. Input Modes (Key Name/URL)
+    # 1. Input Modes (Key Name/URL, bulk rename rule)
+    if context.user_data.get('input_mode') == 'bulk_rename':
+        await process_rename_input(update, context)
+        return
     if 'input_mode' in context.user_data:
         await process_stream_input(update, context)
         return
@@ -52,12 +67,12 @@ async def router_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 2. Main Menu Routing
     if msg == "🎬 视频直播":
         context.user_data['browse_mode'] = 'video'
-        context.user_data['playlist'] = [] # Initialize empty playlist
+        context.user_data['playlist'] = Playlist() # Initialize empty playlist
         await show_alist_files(update, context, path="/")
         
     elif msg == "🎵 音频直播":
         context.user_data['browse_mode'] = 'audio'
-        context.user_data['playlist'] = [] # Initialize empty playlist
+        context.user_data['playlist'] = Playlist() # Initialize empty playlist
         await show_alist_files(update, context, path="/")
         
     elif msg == "🔑 密钥管理":
@@ -66,42 +81,82 @@ async def router_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif msg == "⏹ 停止推流":
         await stop_stream(update, context)
 
+# Callbacks that only act on stream sessions, or snapshot the user's state
+# themselves, skip the user lock: a slow start or log upload must not hold up browsing
+UNLOCKED_CALLBACKS = (
+    "stream_log", "stream_refresh", "stream_autorefresh", "stream_stop", "stream_stop_all",
+    "stream_queue", "stream_qmv", "stream_qdel", "stream_skip", "stream_shuffle", "stream_loop",
+    "action_start_stream", "action_start_live", "action_start_adaptive", "action_live_append"
+)
+
 async def router_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.data.split(":", 1)[0] in UNLOCKED_CALLBACKS:
+        await dispatch_callback(update, context)
+    else:
+        async with user_locks.hold(update.effective_user.id):
+            await dispatch_callback(update, context)
+
+    try: await query.answer()
+    except: pass
+
+async def dispatch_callback(update, context):
     query = update.callback_query
     data = query.data
     
     # File Browser Navigation
     if data.startswith("ls:"):
-        path = data[3:]
-        await show_alist_files(update, context, path=path, edit_msg=True)
+        path, page = parse_ls_callback(data)
+        await show_alist_files(update, context, path=path, page=page, edit_msg=True)
         
     # File Selection (Multi-select)
     elif data.startswith("sel:"):
         await handle_file_selection(update, context, data)
 
+    # Add Whole Folder (recursive)
+    elif data == "action_add_folder":
+        await add_folder_recursive(update, context)
+
     # Start Stream Action
     elif data == "action_start_stream":
         await start_playlist_stream(update, context)
+
+    # Live mode: start a gapless stream / queue onto the running one
+    elif data == "action_start_live":
+        await start_playlist_stream(update, context, live=True)
+    elif data == "action_start_adaptive":
+        await start_playlist_stream(update, context, live=True, normalize=True)
+    elif data == "action_live_append":
+        await append_to_live(update, context)
         
+    # Bulk delete / move / copy / rename of the selection
+    elif data.startswith("bulk_"):
+        await handle_bulk_action(update, context)
+
     # Clear Playlist
     elif data == "action_clear_playlist":
-        context.user_data['playlist'] = []
-        path = context.user_data.get('current_path', '/')
-        await show_alist_files(update, context, path=path, edit_msg=True)
+        get_playlist(context.user_data).clear()
+        await render_file_list(update, context, edit_msg=True)
 
     # Key Management & Stream Controls
     elif data.startswith("stream_"):
-        if data == "stream_stop":
+        # Session-targeted controls carry ':<sid>'
+        if data.startswith("stream_stop:"):
+            await stop_stream(update, context, sid=parse_sid(data))
+        elif data == "stream_stop":
             await stop_stream(update, context)
-        elif data == "stream_refresh":
-            await show_stream_status(update, context)
-        elif data == "stream_log":
-            await view_stream_log(update, context)
+        elif data == "stream_stop_all":
+            await stop_all_streams(update, context)
+        elif data == "stream_refresh" or data.startswith("stream_refresh:"):
+            await show_stream_status(update, context, sid=parse_sid(data))
+        elif data == "stream_log" or data.startswith("stream_log:"):
+            await view_stream_log(update, context, sid=parse_sid(data))
+        elif data.startswith("stream_autorefresh:"):
+            await toggle_status_autorefresh(update, context, sid=parse_sid(data))
+        elif data.split(":", 1)[0] in ("stream_queue", "stream_qmv", "stream_qdel", "stream_skip", "stream_shuffle", "stream_loop"):
+            await handle_live_queue_action(update, context)
         else:
             await handle_stream_key_action(update, context)
-    
-    try: await query.answer()
-    except: pass
 
 async def reset_state(update, context):
     context.user_data.clear()
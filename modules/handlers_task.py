@@ -1,50 +1,60 @@
 
-import subprocess
 import asyncio
+import io
 import logging
 import os
-import json
-import requests
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 from telegram.ext import ContextTypes
-from .config import logger, HTTP_PROXY, HTTPS_PROXY
-from .accounts import alist_mgr
+from telegram.helpers import escape_markdown
+from .utils import format_bytes, IMAGE_EXTS
+from .config import (
+    logger, HTTP_PROXY, HTTPS_PROXY, STATUS_REFRESH_INTERVAL, STATUS_REFRESH_DURATION,
+    LOG_DOWNLOAD_BYTES, PROBE_ENABLED
+)
+from .resolver import resolve_playlist
+from .probe import probe_playlist, check_compat
+from .transcode import TargetProfile
+from .playlist import get_playlist
+from .keystore import key_store
+from .streamer import (
+    StreamSession, SchedulerFull, scheduler, stream_sessions, finished_sessions,
+    get_session, get_session_by_id, launch_session, stop_session, stop_all_sessions
+)
+from .livestream import LiveStreamSession
+from .audiostream import AudioStreamSession, render_cover
+from .mediacache import media_cache
+from .msgedit import message_editor, edit_message
+from .locks import user_locks
 
-# Global Stream State
-stream_sessions = {}
-KEYS_FILE = "stream_keys.json"
-STREAM_LOG_FILE = "stream.log"
 TG_RTMP_BASE = "rtmps://dc5-1.rtmp.t.me/s/"
+LIVE_QUEUE_PAGE_SIZE = 8
 
-# --- Key Management ---
-def load_keys():
-    if not os.path.exists(KEYS_FILE): return {}
-    try:
-        with open(KEYS_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-    except: return {}
-
-def save_key(name, url):
-    keys = load_keys()
-    keys[name] = url
-    with open(KEYS_FILE, 'w', encoding='utf-8') as f: json.dump(keys, f, ensure_ascii=False)
+# Self-refreshing status messages: (chat_id, message_id) -> task
+status_refreshers = {}
 
-def delete_key_by_name(name):
-    keys = load_keys()
-    if name in keys:
-        del keys[name]
-        with open(KEYS_FILE, 'w', encoding='utf-8') as f: json.dump(keys, f, ensure_ascii=False)
+def fanout_keys(context):
+    """Key names the user wants published alongside the selected key"""
+    return context.user_data.setdefault('fanout_keys', [])
 
 # --- Key Manager UI ---
 async def show_key_manager(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keys = load_keys()
+    keys = key_store.all()
     current_key_name = context.user_data.get('selected_key_name')
+    fanout = [n for n in fanout_keys(context) if n != current_key_name]
     
     text = f"🔑 **推流密钥管理**\n当前选中: **{current_key_name or '未选择'}**\n请点击选择要使用的密钥:"
+    if fanout:
+        text += f"\n📡 同步推送到: {', '.join(fanout)}"
     
     kb = []
     for name, url in keys.items():
         icon = "✅" if current_key_name == name else "▪️"
-        kb.append([InlineKeyboardButton(f"{icon} {name}", callback_data=f"stream_key_sel:{name}")])
+        row = [InlineKeyboardButton(f"{icon} {name}", callback_data=f"stream_key_sel:{name}")]
+        if name != current_key_name:
+            fan_icon = "📡 ✔" if name in fanout else "📡"
+            row.append(InlineKeyboardButton(fan_icon, callback_data=f"stream_key_fan:{name}"))
+        kb.append(row)
     
     kb.append([InlineKeyboardButton("➕ 添加新密钥", callback_data="stream_key_add")])
     if keys:
@@ -53,18 +63,18 @@ async def show_key_manager(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(kb)
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await edit_message(update.callback_query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
     else:
         await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def show_key_delete_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keys = load_keys()
+    keys = key_store.all()
     text = "🗑 **点击删除密钥:**"
     kb = []
     for name in keys:
         kb.append([InlineKeyboardButton(f"❌ {name}", callback_data=f"stream_key_del:{name}")])
     kb.append([InlineKeyboardButton("🔙 返回", callback_data="stream_manage_keys")])
-    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(kb), parse_mode='Markdown')
+    await edit_message(update.callback_query.message, text, reply_markup=InlineKeyboardMarkup(kb), parse_mode='Markdown')
 
 async def handle_stream_key_action(update, context):
     query = update.callback_query
@@ -79,15 +89,23 @@ async def handle_stream_key_action(update, context):
         await show_key_delete_menu(update, context)
     elif data.startswith("stream_key_sel:"):
         name = data.split(":", 1)[1]
-        keys = load_keys()
+        keys = key_store.all()
         if name in keys:
             context.user_data['selected_key_name'] = name
             context.user_data['selected_key_url'] = keys[name]
             await query.answer(f"✅ 已选中: {name}")
             await show_key_manager(update, context)
+    elif data.startswith("stream_key_fan:"):
+        # Extra destinations published from the same ffmpeg as the selected key
+        name = data.split(":", 1)[1]
+        fanout = fanout_keys(context)
+        if name in fanout: fanout.remove(name)
+        elif name in key_store.all(): fanout.append(name)
+        await show_key_manager(update, context)
     elif data.startswith("stream_key_del:"):
         name = data.split(":", 1)[1]
-        delete_key_by_name(name)
+        key_store.delete(name)
+        if name in fanout_keys(context): fanout_keys(context).remove(name)
         if context.user_data.get('selected_key_name') == name:
             context.user_data.pop('selected_key_name', None)
             context.user_data.pop('selected_key_url', None)
@@ -108,7 +126,7 @@ async def process_stream_input(update, context):
     elif mode == 'stream_key_value':
         name = context.user_data.get('temp_key_name')
         full_url = f"{TG_RTMP_BASE}{text}"
-        save_key(name, full_url)
+        key_store.set(name, full_url)
         context.user_data['selected_key_name'] = name
         context.user_data['selected_key_url'] = full_url
         
@@ -119,194 +137,549 @@ async def process_stream_input(update, context):
 
 # --- Streaming Logic ---
 
-async def start_playlist_stream(update, context):
+async def resolve_with_progress(update, context, playlist):
+    """Resolve the selection, editing the callback message with progress; reports failures"""
+    query = update.callback_query
+    total = len(playlist)
+    await edit_message(query.message, f"⏳ 正在解析 {total} 个文件的下载地址...")
+
+    last_edit = 0
+    async def on_progress(done, total):
+        nonlocal last_edit
+        now = time.monotonic()
+        if done < total and now - last_edit < 1.0: return
+        last_edit = now
+        await edit_message(query.message, f"⏳ 正在解析 {done}/{total} 个文件的下载地址...")
+
+    resolved, failed = await resolve_playlist(playlist, on_progress=on_progress)
+
+    if failed:
+        lines = [f"• {item['name']}: {reason}" for item, reason in failed[:20]]
+        if len(failed) > 20: lines.append(f"... 以及另外 {len(failed) - 20} 个")
+        await context.bot.send_message(
+            update.effective_chat.id,
+            f"⚠️ {len(failed)} 个文件解析失败，已跳过:\n" + "\n".join(lines)
+        )
+    return resolved
+
+def stream_env():
+    """Environment for ffmpeg/ffprobe with the proxy injected"""
+    env = os.environ.copy()
+    if HTTP_PROXY: env["http_proxy"] = HTTP_PROXY
+    if HTTPS_PROXY: env["https_proxy"] = HTTPS_PROXY
+    env["no_proxy"] = ",".join(filter(None, [env.get("no_proxy"), "127.0.0.1", "localhost"])) # Local relay
+    return env
+
+async def probe_and_report(update, context, resolved, env, warn=True):
+    """ffprobe the resolved files and report incompatible ones; returns (reference signature, total duration)"""
+    query = update.callback_query
+    last_edit = 0
+    async def on_progress(done, total):
+        nonlocal last_edit
+        now = time.monotonic()
+        if done < total and now - last_edit < 1.0: return
+        last_edit = now
+        await edit_message(query.message, f"🔍 正在检测媒体格式 {done}/{total}...")
+
+    try:
+        errors = await probe_playlist(resolved, env=env, on_progress=on_progress)
+    except FileNotFoundError:
+        logger.warning("ffprobe not found, skipping format check")
+        return None, None
+    reference, duration = check_compat(resolved)
+
+    bad = [e for e in resolved if not e['copy_ok']]
+    if bad and warn:
+        lines = []
+        for e in bad[:15]:
+            reason = errors.get(e['path']) or "; ".join(e['compat_issues'])
+            lines.append(f"• {e['name']}: {reason}")
+        if len(bad) > 15: lines.append(f"... 以及另外 {len(bad) - 15} 个")
+        await context.bot.send_message(
+            update.effective_chat.id,
+            f"⚠️ {len(bad)}/{len(resolved)} 个文件与主流格式不一致，直接推流 (-c copy) 可能黑屏或中断:\n"
+            + "\n".join(lines) + "\n\n可改用【🧩 兼容模式】只转码这些文件。"
+        )
+    return reference, duration or None
+
+async def prepare_cover(update, context, covers, env):
+    """Cover clip for audio mode (first image, black if none or it fails); None if ffmpeg cannot run"""
+    query = update.callback_query
+    await edit_message(query.message, "🖼 正在生成封面画面...")
+    if len(covers) > 1:
+        await context.bot.send_message(update.effective_chat.id, f"ℹ️ 选择了 {len(covers)} 张图片，仅使用第一张作为封面: {covers[0]['name']}")
+    for image in covers[:1] + [None]:
+        try:
+            return await render_cover(image, env)
+        except Exception as e:
+            logger.error(f"Cover rendering failed ({image['name'] if image else 'black'}): {e}")
+            if image:
+                await context.bot.send_message(update.effective_chat.id, f"⚠️ 封面生成失败 ({e})，改用黑色画面")
+    await context.bot.send_message(update.effective_chat.id, "❌ 无法生成视频画面，请检查 ffmpeg 是否可用")
+    return None
+
+async def start_playlist_stream(update, context, live=False, normalize=False):
     query = update.callback_query
     user_id = update.effective_user.id
-    
+
+    # Runs outside the user lock (resolving can take a while): take a consistent snapshot of the user's state
+    async with user_locks.hold(user_id):
+        rtmp_url = context.user_data.get('selected_key_url')
+        key_name = context.user_data.get('selected_key_name') or "default"
+        playlist = get_playlist(context.user_data).items()
+        audio = context.user_data.get('browse_mode') == 'audio' and not live
+        fanout = list(fanout_keys(context))
+
     # 1. Check Key
-    rtmp_url = context.user_data.get('selected_key_url')
     if not rtmp_url:
         await query.answer("❌ 未选择推流密钥，请先去[密钥管理]设置", show_alert=True)
         return
 
     # 2. Check Playlist
-    playlist = context.user_data.get('playlist', [])
     if not playlist:
         await query.answer("❌ 播放列表为空", show_alert=True)
         return
 
-    # 3. Resolve Direct URLs
-    await query.edit_message_text(f"⏳ 正在解析 {len(playlist)} 个文件的下载地址...")
+    # 3. Resolve Direct URLs (concurrent, cached by path)
+    resolved = await resolve_with_progress(update, context, playlist)
     
-    resolved_files = []
-    for item in playlist:
-        resp = alist_mgr.get_file_info(item['path'])
-        if resp and resp.get('code') == 200:
-            raw_url = resp['data']['raw_url']
-            # Fix URL appending logic: Check if ? exists
-            if resp['data'].get('sign'):
-                separator = "&" if "?" in raw_url else "?"
-                raw_url += f"{separator}sign={resp['data']['sign']}"
-            resolved_files.append(raw_url)
-    
-    if not resolved_files:
+    if not resolved:
         await context.bot.send_message(update.effective_chat.id, "❌ 无法获取文件链接")
         return
 
-    # 4. Generate Playlist File (concat.txt)
-    playlist_content = ""
-    for url in resolved_files:
-        safe_url = url.replace("'", "'\\''") 
-        playlist_content += f"file '{safe_url}'\n"
-    
-    playlist_path = f"playlist_{user_id}.txt"
-    with open(playlist_path, "w", encoding='utf-8') as f:
-        f.write(playlist_content)
-
-    # 5. Stop Previous Stream
-    await stop_stream(update, context, silent=True)
-
-    # 6. Build FFmpeg Command
-    # Removed -reconnect options to fix 'Option not found' crash. 
-    # The proxy environment variables are still injected below to help with speed.
-    cmd = [
-        "ffmpeg",
-        "-re", 
-        "-f", "concat",
-        "-safe", "0",
-        "-protocol_whitelist", "file,http,https,tcp,tls",
-        "-i", playlist_path,
-        "-c", "copy",
-        "-f", "flv",
-        "-loglevel", "info", 
-        rtmp_url
-    ]
-
     # Prepare Environment with Proxy
-    env = os.environ.copy()
-    if HTTP_PROXY: env["http_proxy"] = HTTP_PROXY
-    if HTTPS_PROXY: env["https_proxy"] = HTTPS_PROXY
+    env = stream_env()
 
-    try:
-        # Open log file
-        log_file = open(STREAM_LOG_FILE, "w")
-        
-        # Start process with stderr redirected to log file
-        process = subprocess.Popen(
-            cmd, 
-            stdout=subprocess.DEVNULL, 
-            stderr=log_file,
-            env=env  # Inject proxy env
-        )
-        
-        stream_sessions[user_id] = {
-            'process': process,
-            'playlist_file': playlist_path,
-            'log_handle': log_file,
-            'count': len(resolved_files)
-        }
-        
+    # Audio mode: images become the (pre-rendered) cover, the rest is the audio playlist
+    options = {}
+    if audio:
+        covers = [e for e in resolved if e['name'].lower().endswith(IMAGE_EXTS)]
+        resolved = [e for e in resolved if not e['name'].lower().endswith(IMAGE_EXTS)]
+        if not resolved:
+            await context.bot.send_message(update.effective_chat.id, "❌ 请至少选择一个音频文件")
+            return
+        options['cover_file'] = await prepare_cover(update, context, covers, env)
+        if not options['cover_file']: return
+
+    # 4. Probe formats (cached per file) and warn about files that break stream copy
+    reference, duration = None, None
+    if PROBE_ENABLED:
+        # Audio items are decoded one by one (mixed codecs are fine), so only the duration matters there
+        reference, duration = await probe_and_report(update, context, resolved, env, warn=not (normalize or audio))
+
+    # Compatibility mode: one target profile, only the outliers get transcoded
+    profile = TargetProfile.for_playlist(reference) if normalize else None
+    if profile:
+        outliers = sum(1 for e in resolved if not profile.matches(e.get('probe')))
         await context.bot.send_message(
             update.effective_chat.id,
-            f"🚀 **推流已启动!**\n\n"
-            f"📄 文件数: {len(resolved_files)}\n"
-            f"🔑 目标: {context.user_data.get('selected_key_name')}\n"
-            f"📝 日志: 已记录到 `{STREAM_LOG_FILE}`\n"
-            f"🌐 代理: {'✅ 启用' if HTTPS_PROXY else '❌ 未配置'}\n\n"
-            f"若画面黑屏，请点击【查看日志】下载完整日志进行排查。",
-            parse_mode='Markdown'
+            f"🧩 兼容模式: 目标格式 {profile}\n{outliers} 个文件将转码，{len(resolved) - outliers} 个直通"
         )
-        # Immediately show status panel
-        await show_stream_status(update, context, new_msg=True)
-        
+
+    # 5. Hand the session to the scheduler (starts now or queues), replacing
+    # any stream already using these keys. Live sessions keep one RTMP
+    # connection and take queue edits while running
+    keys = key_store.all()
+    extra = [(n, keys[n]) for n in fanout if n != key_name and n in keys]
+    if live: options['profile'] = profile
+    session_cls = LiveStreamSession if live else AudioStreamSession if audio else StreamSession
+    session = session_cls(
+        name=key_name,
+        rtmp_url=rtmp_url,
+        items=resolved,
+        owner_id=user_id,
+        chat_id=update.effective_chat.id,
+        bot=context.bot,
+        env=env,  # Inject proxy env
+        extra_destinations=extra,
+        **options
+    )
+    session.total_duration = duration
+    try:
+        outcome = await launch_session(session)
+    except SchedulerFull as e:
+        await context.bot.send_message(update.effective_chat.id, f"⛔ 设备负载已满，无法启动: {e}")
+        return
     except Exception as e:
         await context.bot.send_message(update.effective_chat.id, f"❌ 启动失败: {e}")
+        return
 
-async def stop_stream(update, context, silent=False):
-    user_id = update.effective_user.id
-    if user_id in stream_sessions:
-        session = stream_sessions[user_id]
-        proc = session['process']
-        proc.terminate()
-        try: proc.wait(timeout=5)
-        except: proc.kill()
-        
-        # Cleanup
-        if os.path.exists(session['playlist_file']):
-            os.remove(session['playlist_file'])
-        
-        # Close log file handle
-        try: session['log_handle'].close()
-        except: pass
-            
-        del stream_sessions[user_id]
+    if outcome == 'queued':
+        await context.bot.send_message(
+            update.effective_chat.id,
+            f"⏳ **设备负载已满，已加入排队** (第 {len(scheduler.queue)} 位)\n"
+            f"🔑 目标: {escape_markdown(key_name)}\n有推流结束后将自动启动。",
+            parse_mode='Markdown'
+        )
+        return
+
+    await context.bot.send_message(
+        update.effective_chat.id,
+        f"🚀 **推流已启动!**{' (兼容模式)' if profile else ' (无缝直播)' if live else ' (音频直播)' if audio else ''}\n\n"
+        f"📄 文件数: {session.count}"
+        f"{f' | ⏱ 总时长: {format_duration(duration)}' if duration else ''}\n"
+        f"🔑 目标: {escape_markdown(', '.join(d['name'] for d in session.destinations))}\n"
+        f"📝 日志: 已记录到 `{session.log_file}`\n"
+        f"🌐 代理: {'✅ 启用' if HTTPS_PROXY else '❌ 未配置'}\n\n"
+        f"若画面黑屏，请点击【查看日志】下载完整日志进行排查。",
+        parse_mode='Markdown'
+    )
+    # Immediately show status panel
+    await show_stream_status(update, context, new_msg=True, sid=session.sid)
+
+def parse_sid(data):
+    """'stream_xxx:<sid>' -> sid (None when absent)"""
+    _, sep, tail = data.partition(":")
+    return int(tail) if sep and tail.isdigit() else None
+
+def live_session_for(context):
+    """The live session on the user's selected key, if any"""
+    session = get_session(context.user_data.get('selected_key_name') or "default")
+    if session and session.mode == 'live' and session.state in ('queued', 'running', 'recovering'):
+        return session
+    return None
+
+async def append_to_live(update, context):
+    """Queue the current selection onto the running live stream without reconnecting"""
+    query = update.callback_query
+    session = live_session_for(context)
+    if not session:
+        await query.answer("❌ 当前密钥没有无缝直播任务", show_alert=True)
+        return
+    async with user_locks.hold(update.effective_user.id):
+        playlist = get_playlist(context.user_data).items()
+    if not playlist:
+        await query.answer("❌ 播放列表为空", show_alert=True)
+        return
+
+    resolved = await resolve_with_progress(update, context, playlist)
+    if not resolved:
+        await context.bot.send_message(update.effective_chat.id, "❌ 无法获取文件链接")
+        return
+    if session.profile and PROBE_ENABLED: # Copy-vs-transcode needs the format
+        await probe_and_report(update, context, resolved, session.env, warn=False)
+    added = session.append(resolved)
+    # Deselect what was queued (the snapshot is a copy); files picked meanwhile stay selected
+    async with user_locks.hold(update.effective_user.id):
+        selection = get_playlist(context.user_data)
+        for item in playlist: selection.remove(item['path'])
+    await context.bot.send_message(
+        update.effective_chat.id,
+        f"➕ 已追加 {added} 个文件到 **{escape_markdown(session.name)}**，当前队列 {session.count} 个",
+        parse_mode='Markdown'
+    )
+    await show_live_queue(update, context, session.sid, new_msg=True)
+
+def parse_queue_callback(data):
+    """'stream_qxx:<sid>:<a>[:<b>]' -> (sid, [ints])"""
+    parts = data.split(":")[1:]
+    try: numbers = [int(p) for p in parts]
+    except ValueError: return None, []
+    return (numbers[0], numbers[1:]) if numbers else (None, [])
+
+def build_live_queue(session, page=None):
+    """Queue view with per-item reorder/remove buttons"""
+    if session is None or session.mode != 'live':
+        return "⚪️ 该任务已结束", InlineKeyboardMarkup([[InlineKeyboardButton("📋 全部任务", callback_data="stream_refresh")]])
+
+    count = session.count
+    pages = max(1, (count + LIVE_QUEUE_PAGE_SIZE - 1) // LIVE_QUEUE_PAGE_SIZE)
+    if page is None: page = max(0, session.current_index) // LIVE_QUEUE_PAGE_SIZE
+    page = min(max(0, page), pages - 1)
+    sid = session.sid
+
+    text = (
+        f"📋 **直播队列** ({escape_markdown(session.name)})\n"
+        f"共 {count} 个文件 | 循环: {'开' if session.loop else '关'}"
+    )
+    if pages > 1: text += f" | 第 {page + 1}/{pages} 页"
+
+    kb = []
+    start = page * LIVE_QUEUE_PAGE_SIZE
+    for idx in range(start, min(count, start + LIVE_QUEUE_PAGE_SIZE)):
+        name = session.items[idx]['name']
+        short = (name[:22] + '..') if len(name) > 22 else name
+        icon = "▶️" if idx == session.current_index else f"{idx + 1}."
+        kb.append([
+            InlineKeyboardButton(f"{icon} {short}", callback_data=f"stream_queue:{sid}:{page}"),
+            InlineKeyboardButton("⬆️", callback_data=f"stream_qmv:{sid}:{idx}:-1"),
+            InlineKeyboardButton("⬇️", callback_data=f"stream_qmv:{sid}:{idx}:1"),
+            InlineKeyboardButton("❌", callback_data=f"stream_qdel:{sid}:{idx}")
+        ])
+
+    if pages > 1:
+        page_row = []
+        if page > 0: page_row.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"stream_queue:{sid}:{page - 1}"))
+        if page < pages - 1: page_row.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"stream_queue:{sid}:{page + 1}"))
+        kb.append(page_row)
+    kb.append([
+        InlineKeyboardButton("⏭ 下一个", callback_data=f"stream_skip:{sid}"),
+        InlineKeyboardButton("🔀 打乱", callback_data=f"stream_shuffle:{sid}"),
+        InlineKeyboardButton("🔁 循环", callback_data=f"stream_loop:{sid}")
+    ])
+    kb.append([InlineKeyboardButton("🔙 推流状态", callback_data=f"stream_refresh:{sid}")])
+    return text, InlineKeyboardMarkup(kb)
+
+async def show_live_queue(update, context, sid, page=None, new_msg=False):
+    text, reply_markup = build_live_queue(get_session_by_id(sid), page)
+    if new_msg or not update.callback_query:
+        await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await edit_message(update.callback_query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def handle_live_queue_action(update, context):
+    """stream_queue / stream_qmv / stream_qdel / stream_skip / stream_shuffle / stream_loop"""
+    query = update.callback_query
+    action = query.data.split(":", 1)[0]
+    sid, args = parse_queue_callback(query.data)
+    session = get_session_by_id(sid) if sid is not None else None
+    if session is None or session.mode != 'live':
+        await query.answer("❌ 该任务已结束", show_alert=True)
+        return
+
+    page = None
+    if action == "stream_queue":
+        page = args[0] if args else None
+    elif action == "stream_qmv" and len(args) == 2:
+        if session.move(args[0], args[1]):
+            page = (args[0] + args[1]) // LIVE_QUEUE_PAGE_SIZE
+    elif action == "stream_qdel" and args:
+        entry = session.remove(args[0])
+        if entry: await query.answer(f"🗑 已移除: {entry['name'][:40]}")
+        page = args[0] // LIVE_QUEUE_PAGE_SIZE
+    elif action == "stream_skip":
+        session.skip()
+        await query.answer("⏭ 已切到下一个")
+    elif action == "stream_shuffle":
+        session.shuffle()
+        await query.answer("🔀 后续文件已打乱")
+    elif action == "stream_loop":
+        session.loop = not session.loop
+        await query.answer(f"🔁 循环播放: {'开' if session.loop else '关'}")
+    await show_live_queue(update, context, sid, page=page)
+
+async def stop_stream(update, context, silent=False, sid=None):
+    """Stop one session (by sid), the only session, or offer a choice"""
+    chat_id = update.effective_chat.id
+    if sid is not None:
+        session = get_session_by_id(sid)
+    elif len(stream_sessions) == 1:
+        session = next(iter(stream_sessions.values()))
+    elif stream_sessions:
+        if not silent: await show_streams_overview(update, context, new_msg=True)
+        return
+    else:
+        session = None
+
+    if session:
+        # Graceful SIGTERM, escalates to SIGKILL without blocking the loop
+        await stop_session(session.name)
         if not silent:
-            await context.bot.send_message(update.effective_chat.id, "✅ 推流已停止")
+            await context.bot.send_message(chat_id, f"✅ 推流已停止: {session.name}")
     else:
         if not silent:
-            await context.bot.send_message(update.effective_chat.id, "⚪️ 当前没有推流任务")
+            await context.bot.send_message(chat_id, "⚪️ 当前没有推流任务")
 
-async def show_stream_status(update, context, new_msg=False):
-    user_id = update.effective_user.id
-    is_streaming = user_id in stream_sessions and stream_sessions[user_id]['process'].poll() is None
-    
-    status = "🟢 正在直播" if is_streaming else "⚪️ 空闲 (或已退出)"
-    count = stream_sessions.get(user_id, {}).get('count', 0)
+async def stop_all_streams(update, context):
+    n = len(stream_sessions)
+    await stop_all_sessions()
+    await context.bot.send_message(update.effective_chat.id, f"✅ 已停止全部 {n} 路推流")
+
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def session_state_label(session):
+    if session is None: return "⚪️ 空闲"
+    if session.is_running: return "🟢 正在直播"
+    if session.state == 'queued': return "⏳ 排队中"
+    if session.state == 'starting': return "🟡 启动中"
+    if session.state == 'recovering': return f"🟠 自动恢复中 (已重启 {session.restarts} 次)"
+    if session.state == 'exited': return f"🔴 已退出 (code {session.returncode})"
+    return "⚪️ 空闲"
+
+def build_streams_overview():
+    """All sessions plus scheduler load"""
+    count, kbps = scheduler.usage()
+    text = (
+        f"📺 **推流任务** ({len(stream_sessions)})\n"
+        f"🧮 负载: {count}/{scheduler.max_streams} 路 | "
+        f"{kbps:.0f}/{scheduler.max_kbps} kbps | 排队 {len(scheduler.queue)}"
+    )
+    if media_cache.enabled:
+        st = media_cache.stats()
+        text += (
+            f"\n💾 媒体缓存: {format_bytes(st['bytes'])}/{format_bytes(st['max_bytes'])} ({st['files']} 个文件)"
+            f" | 命中率 {st['hit_ratio']:.0%} ({st['hits']}/{st['hits'] + st['misses']})"
+        )
+        if st['downloading']: text += f" | 下载中 {st['downloading']}"
+    kb = []
+    for session in stream_sessions.values():
+        text += f"\n• {escape_markdown(session.name)}: {session_state_label(session)}"
+        kb.append([
+            InlineKeyboardButton(f"📺 {session.name}", callback_data=f"stream_refresh:{session.sid}"),
+            InlineKeyboardButton("⏹ 停止", callback_data=f"stream_stop:{session.sid}")
+        ])
+    row = [InlineKeyboardButton("🔄 刷新", callback_data="stream_refresh")]
+    if stream_sessions:
+        row.append(InlineKeyboardButton("⏹ 全部停止", callback_data="stream_stop_all"))
+    kb.append(row)
+    return text, InlineKeyboardMarkup(kb)
+
+async def show_streams_overview(update, context, new_msg=False):
+    text, reply_markup = build_streams_overview()
+    if new_msg or not update.callback_query:
+        await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await edit_message(update.callback_query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def build_stream_status(session, auto_refresh=False):
+    """Status text + keyboard for one session"""
+    is_streaming = session is not None and session.is_running
+    count = session.count if session else 0
     
-    text = f"📺 **推流状态**: {status}\n正在播放: {count} 个文件"
+    name = escape_markdown(session.name) if session else "-"
+    text = f"📺 **推流状态** ({name}): {session_state_label(session)}\n正在播放: {count} 个文件"
+
+    if session:
+        item = session.current_item
+        if item and session.progress:
+            text += (
+                f"\n▶️ 当前: {session.current_index + 1}/{count} {escape_markdown(item['name'])}"
+                f" ({format_duration(session.item_position)})"
+            )
+        if session.total_duration:
+            text += f"\n⏱ 总时长: {format_duration(session.total_duration)}"
+        if session.mode == 'live':
+            text += f"\n📡 无缝直播 | 循环: {'开' if session.loop else '关'}"
+            if session.feed_errors: text += f" | 读取失败: {session.feed_errors}"
+            if session.profile:
+                now = "转码" if session.current_transcoding else "直通"
+                text += f"\n🧩 兼容模式 ({now}) | 已转码 {session.transcoded} / 直通 {session.copied}"
+        elif session.mode == 'audio' and session.feed_errors:
+            text += f"\n🎵 读取失败: {session.feed_errors}"
+        if session.restarts:
+            text += f"\n♻️ 自动重启: {session.restarts} 次"
+        if len(session.destinations) > 1:
+            text += f"\n📡 同步推送 {len(session.destinations)} 路:"
+            for dest in session.destinations:
+                icon = "🔴" if dest['failed'] else "🟢"
+                text += (
+                    f"\n  {icon} {escape_markdown(dest['name'])}: ~{format_bytes(session.destination_bytes(dest))}"
+                    f" | 错误 {dest['errors']}"
+                )
+        p = session.progress
+        if p:
+            speed = p.get('speed')
+            speed_text = f"{speed:.2f}x" if speed is not None else "N/A"
+            if speed is not None and speed < 0.95 and is_streaming:
+                speed_text += " ⚠️ 低于实时"
+            text += (
+                f"\n⏱ 时长: {format_duration(p.get('out_time'))} | 速度: {speed_text}"
+                f"\n🎞 FPS: {p.get('fps', 0):.1f} | 码率: {p.get('bitrate', 'N/A')}"
+                f"\n📉 丢帧: {p.get('drop_frames', 0)} | 重复帧: {p.get('dup_frames', 0)}"
+                f"\n🕒 更新于 {int(time.time() - p['updated_at'])} 秒前"
+            )
     
+    sid = session.sid if session else 0
     kb = []
-    row1 = [InlineKeyboardButton("🔄 刷新状态", callback_data="stream_refresh")]
-    if is_streaming:
-        row1.append(InlineKeyboardButton("⏹ 停止", callback_data="stream_stop"))
+    row1 = [InlineKeyboardButton("🔄 刷新状态", callback_data=f"stream_refresh:{sid}")]
+    if is_streaming or (session and session.state == 'queued'):
+        row1.append(InlineKeyboardButton("⏹ 停止", callback_data=f"stream_stop:{sid}"))
     kb.append(row1)
+    if is_streaming:
+        label = "⏸ 停止自动刷新" if auto_refresh else "⏱ 自动刷新"
+        kb.append([InlineKeyboardButton(label, callback_data=f"stream_autorefresh:{sid}")])
+    if session and session.mode == 'live' and session.state in ('queued', 'running', 'recovering'):
+        kb.append([
+            InlineKeyboardButton("📋 直播队列", callback_data=f"stream_queue:{sid}"),
+            InlineKeyboardButton("⏭ 下一个", callback_data=f"stream_skip:{sid}")
+        ])
     
     # Add Log View Button
-    kb.append([InlineKeyboardButton("📝 查看/下载日志", callback_data="stream_log")])
+    kb.append([
+        InlineKeyboardButton("📝 查看/下载日志", callback_data=f"stream_log:{sid}"),
+        InlineKeyboardButton("📋 全部任务", callback_data="stream_refresh")
+    ])
         
-    reply_markup = InlineKeyboardMarkup(kb)
+    return text, InlineKeyboardMarkup(kb)
+
+async def show_stream_status(update, context, new_msg=False, sid=None):
+    if sid is None:
+        # No target: a single session is shown directly, several as an overview
+        if len(stream_sessions) != 1:
+            await show_streams_overview(update, context, new_msg=new_msg)
+            return
+        sid = next(iter(stream_sessions.values())).sid
+    session = get_session_by_id(sid)
+    message = update.callback_query.message if update.callback_query else None
+    auto = message is not None and (message.chat_id, message.message_id) in status_refreshers
+    text, reply_markup = build_stream_status(session, auto_refresh=auto and not new_msg)
     
     if new_msg:
          await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup, parse_mode='Markdown')
     elif update.callback_query:
-        try: await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-        except: pass
+        await edit_message(update.callback_query.message, text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def toggle_status_autorefresh(update, context, sid):
+    """Start/stop a task that keeps editing this status message"""
+    query = update.callback_query
+    key = (query.message.chat_id, query.message.message_id)
+    task = status_refreshers.pop(key, None)
+    if task:
+        task.cancel()
+        await show_stream_status(update, context, sid=sid)
+        return
+
+    bot = context.bot
 
-async def view_stream_log(update, context):
-    if not os.path.exists(STREAM_LOG_FILE):
-        await update.callback_query.answer("❌ 暂无日志文件", show_alert=True)
+    async def refresher():
+        deadline = time.monotonic() + STATUS_REFRESH_DURATION
+        try:
+            while time.monotonic() < deadline:
+                session = get_session_by_id(sid)
+                running = session is not None and session.is_running
+                text, markup = build_stream_status(session, auto_refresh=running)
+                # Unchanged states are skipped by the editor, so idle sessions cost no API calls
+                await message_editor.edit(bot, key[0], key[1], text, reply_markup=markup, parse_mode='Markdown')
+                if not running: break
+                await asyncio.sleep(STATUS_REFRESH_INTERVAL)
+        finally:
+            if status_refreshers.get(key) is asyncio.current_task():
+                status_refreshers.pop(key, None)
+
+    status_refreshers[key] = asyncio.get_running_loop().create_task(refresher())
+
+async def view_stream_log(update, context, sid=None):
+    # Stopped or replaced sessions keep their log: that is when it is needed most
+    session = get_session_by_id(sid, include_finished=True) if sid is not None else None
+    if session is None:
+        candidates = list(stream_sessions.values()) or list(finished_sessions.values())
+        if len(candidates) == 1: session = candidates[0]
+    if session is None or not session.log.ring.tail(1):
+        await update.callback_query.answer("❌ 暂无日志", show_alert=True)
         return
     
     chat_id = update.effective_chat.id
     
-    # 1. Send Full Log File (This ensures "All" logs are seen)
+    # 1. Send the recent log window (bounded, straight from the in-memory ring)
     try:
-        with open(STREAM_LOG_FILE, 'rb') as f:
-             await context.bot.send_document(
-                chat_id=chat_id,
-                document=f,
-                filename="stream_debug.log",
-                caption="📄 **完整推流日志文件**",
-                parse_mode='Markdown'
-            )
+        await context.bot.send_document(
+            chat_id=chat_id,
+            document=io.BytesIO(session.log.ring.dump(LOG_DOWNLOAD_BYTES)),
+            filename=f"stream_{session.sid}_debug.log",
+            caption=f"📄 **最近推流日志** ({escape_markdown(session.name)})\n完整轮转日志: `{session.log_file}`",
+            parse_mode='Markdown'
+        )
     except Exception as e:
         await context.bot.send_message(chat_id, f"❌ 发送日志文件失败: {e}")
 
     # 2. Show Preview (Text)
-    try:
-        # Read last 3000 chars for preview
-        with open(STREAM_LOG_FILE, "rb") as f:
-            try: f.seek(-3000, os.SEEK_END) # Go to end approx
-            except: f.seek(0) # File too small
-            content = f.read().decode('utf-8', errors='ignore')
-            
-        if content:
-            lines = [l for l in content.splitlines() if l.strip()]
-            preview = "\n".join(lines[-30:]) # Show last 30 lines
-            
-            msg = f"📝 **日志预览 (最后部分):**\n```\n{preview}\n```"
-            await context.bot.send_message(chat_id, msg, parse_mode='Markdown')
-    except Exception as e:
-        pass
+    preview = "\n".join(session.log.ring.tail(30)) # Show last 30 lines
+    if preview:
+        if len(preview) > 3500: preview = preview[-3500:]
+        msg = f"📝 **日志预览 (最后部分):**\n```\n{preview}\n```"
+        try: await context.bot.send_message(chat_id, msg, parse_mode='Markdown')
+        except Exception: pass
         
     await update.callback_query.answer()
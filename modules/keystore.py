@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import threading
+from .config import KEYS_FILE
+
+logger = logging.getLogger("KeyStore")
+
+class KeyStore:
+    """
+    Stream keys (name -> RTMP URL) held in memory.
+    Writes go to a temp file that is fsynced and renamed over the original,
+    so a crash never leaves a half-written file. Edits made to the file by
+    hand are picked up on the next read via its mtime.
+    """
+    def __init__(self, path=KEYS_FILE):
+        self.path = path
+        self._keys = {}
+        self._mtime = None
+        self._lock = threading.RLock()
+
+    def _file_mtime(self):
+        try: return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError: return None
+
+    def _refresh(self):
+        """Reload if the file changed since we last read or wrote it"""
+        mtime = self._file_mtime()
+        if mtime == self._mtime: return
+        self._mtime = mtime
+        if mtime is None:
+            self._keys = {}
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("top level is not an object")
+            self._keys = {str(k): str(v) for k, v in data.items()}
+        except (OSError, ValueError) as e:
+            # Keep serving the last good copy rather than pretending there are no keys
+            logger.error(f"Cannot read {self.path}, keeping {len(self._keys)} cached keys: {e}")
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._keys, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        try: # Persist the rename itself
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try: os.fsync(dir_fd)
+            finally: os.close(dir_fd)
+        except OSError: pass
+        self._mtime = self._file_mtime()
+
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return dict(self._keys)
+
+    def get(self, name):
+        with self._lock:
+            self._refresh()
+            return self._keys.get(name)
+
+    def set(self, name, url):
+        with self._lock:
+            self._refresh()
+            self._keys[name] = url
+            self._save()
+
+    def delete(self, name):
+        """Returns True if the key existed"""
+        with self._lock:
+            self._refresh()
+            if name not in self._keys: return False
+            del self._keys[name]
+            self._save()
+            return True
+
+# Singleton
+key_store = KeyStore()
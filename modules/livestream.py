@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import random
+import re
+from .config import STREAM_STOP_TIMEOUT
+from .resolver import resolve_item, link_cache
+from .relay import relay
+from .mediacache import media_cache
+from .streamer import StreamSession
+
+logger = logging.getLogger("LiveStream")
+
+# `-progress` lines the feeders print on stderr (everything else is a real log line)
+FEED_PROGRESS_RE = re.compile(r"^[a-z0-9_]+=")
+FEED_CHUNK = 64 * 1024
+# Feeders report the last packet's time, not the item's end: leave one frame of room
+FEED_FRAME_GAP = 0.04
+FEED_PROGRESS_PERIOD = 0.5 # ffmpeg's default -stats_period
+
+class LiveStreamSession(StreamSession):
+    """
+    Publisher that never reopens the RTMP connection between items.
+    One long-lived ffmpeg reads MPEG-TS on stdin and remuxes it to FLV; a
+    feeder task runs a short ffmpeg per item (-re, stream copy to MPEG-TS)
+    and pumps it into that pipe with timestamps continued from the previous
+    item. The queue (self.items) can be edited while the stream is live.
+    With a TargetProfile (compatibility mode) items that do not match it are
+    transcoded by their feeder; matching items stay on stream copy.
+    """
+    mode = 'live'
+    stdin_mode = asyncio.subprocess.PIPE
+
+    def __init__(self, *args, loop=False, profile=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.playlist_file = None # Fed through stdin, no concat list
+        self.loop = loop
+        self.profile = profile # TargetProfile: transcode items that do not match it (compatibility mode)
+        self.copied = 0
+        self.transcoded = 0
+        self.current_transcoding = False
+        self.feed_errors = 0
+        self._feeder = None
+        self._feed_proc = None
+        self._skipped = False
+        self._ts_offset = 0.0
+
+    def build_cmd(self):
+        return [
+            "ffmpeg",
+            "-fflags", "+genpts",
+            "-f", "mpegts",
+            "-i", "pipe:0",
+            "-c", "copy",
+            "-loglevel", "info",
+            "-progress", "pipe:1",
+            "-nostats",
+            *self.output_args()
+        ]
+
+    def needs_transcode(self, item):
+        return self.profile is not None and not self.profile.matches(item.get('probe'))
+
+    def build_feed_cmd(self, url, inpoint=0.0, item=None):
+        """One item as real-time MPEG-TS on stdout, shifted to follow the previous item"""
+        transcode = item is not None and self.needs_transcode(item)
+        cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-re"]
+        if inpoint > 0: cmd += ["-ss", f"{inpoint:.3f}"]
+        cmd += ["-i", url]
+        if transcode:
+            info = item.get('probe')
+            cmd += self.profile.input_args(info) + self.profile.encode_args(info)
+        else:
+            cmd += ["-map", "0:v:0?", "-map", "0:a:0?", "-c", "copy"]
+        cmd += [
+            "-output_ts_offset", f"{self._ts_offset:.3f}",
+            "-progress", "pipe:2", # Interleaved with errors on stderr
+            "-f", "mpegts",
+            "pipe:1"
+        ]
+        return cmd
+
+    # --- Queue editing (safe while live) ---
+
+    def append(self, entries):
+        """Queue resolved entries at the end; returns how many were added"""
+        self.items.extend(entries)
+        return len(entries)
+
+    def remove(self, index):
+        """Drop one queued item; removing the playing item skips to the next"""
+        if not 0 <= index < len(self.items): return None
+        entry = self.items.pop(index)
+        if index < self.current_index:
+            self.current_index -= 1
+        elif index == self.current_index:
+            self.current_index -= 1 # The feeder continues with whatever took its place
+            self.skip()
+        return entry
+
+    def move(self, index, delta):
+        """Swap an item with its neighbour (delta -1 = up, +1 = down)"""
+        target = index + delta
+        if not (0 <= index < len(self.items) and 0 <= target < len(self.items)): return False
+        playing = self.current_item
+        self.items[index], self.items[target] = self.items[target], self.items[index]
+        if playing is not None:
+            self.current_index = next(i for i, it in enumerate(self.items) if it is playing)
+        return True
+
+    def shuffle(self):
+        """Shuffle the items after the playing one"""
+        upcoming = self.items[self.current_index + 1:]
+        random.shuffle(upcoming)
+        self.items[self.current_index + 1:] = upcoming
+
+    def skip(self):
+        """End the playing item now and move on"""
+        self._skipped = True
+        self._kill_feed()
+
+    # --- Feeder ---
+
+    def _kill_feed(self):
+        if self._feed_proc and self._feed_proc.returncode is None:
+            try: self._feed_proc.kill()
+            except ProcessLookupError: pass
+
+    def _stop_feeder(self):
+        if self._feeder and self._feeder is not asyncio.current_task():
+            self._feeder.cancel()
+        self._feeder = None
+        self._kill_feed()
+
+    def _prepare_input(self, start_index, inpoint):
+        self._stop_feeder()
+        self._ts_offset = 0.0
+
+    def _after_spawn(self, start_index, inpoint):
+        self._feeder = asyncio.get_running_loop().create_task(self._feed(start_index, inpoint))
+
+    async def _feed(self, index, inpoint):
+        publisher = self.process
+        failures = 0
+        try:
+            while self.state == 'running' and publisher.returncode is None:
+                if index >= len(self.items):
+                    if not (self.loop and self.items): break
+                    index = 0
+                self.current_index = index
+                self.item_started_at = self._ts_offset # Where this item lands on the publisher's clock
+                self.item_base_offset = inpoint
+                ok = await self._feed_item(publisher, self.items[index], inpoint)
+                inpoint = 0.0
+                if publisher.returncode is not None: return
+                failures = 0 if ok else failures + 1
+                if failures and failures >= len(self.items):
+                    # Nothing in the queue is playable: let the watchdog re-resolve from scratch
+                    self._restart_reason = "队列中的文件均无法读取"
+                    publisher.kill()
+                    return
+                index = self.current_index + 1
+            # Queue exhausted: closing stdin lets the publisher flush and exit cleanly
+            publisher.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # Publisher died; _watch_exit handles it
+        except Exception as e:
+            logger.error(f"Feeder for {self.name} crashed: {e}")
+            self._restart_reason = f"输入管道异常: {e}"
+            try: publisher.kill()
+            except ProcessLookupError: pass
+        finally:
+            self._kill_feed()
+
+    async def _feed_item(self, publisher, item, inpoint):
+        """Pump one item into the publisher; returns False if the item could not be played"""
+        try:
+            # Cached until the link is about to expire; files on a Local storage come back as disk paths
+            entry = media_cache.localize(await resolve_item(item), self.sid)
+        except Exception as e:
+            self.log.write(f"[feeder] 无法解析 {item['name']}: {e}\n")
+            self.feed_errors += 1
+            return False
+
+        # Relay the item, and let it pre-open whatever is queued next
+        upcoming = self.items[self.current_index + 1:self.current_index + 2] or (self.items[:1] if self.loop else [])
+        url = relay.register_playlist(self.sid, [entry] + upcoming)[0]
+
+        self._skipped = False
+        self.current_transcoding = self.needs_transcode(item)
+        if self.current_transcoding: self.transcoded += 1
+        else: self.copied += 1
+        self._feed_proc = proc = await asyncio.create_subprocess_exec(
+            *self.build_feed_cmd(url, inpoint, item),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=self.env
+        )
+        last_time = [0.0]
+        stderr_task = asyncio.get_running_loop().create_task(self._read_feed_log(proc, last_time))
+        sent = 0
+        try:
+            while True:
+                chunk = await proc.stdout.read(FEED_CHUNK)
+                if not chunk: break
+                publisher.stdin.write(chunk)
+                await publisher.stdin.drain()
+                sent += len(chunk)
+        finally:
+            self._kill_feed() # No-op after a clean EOF; stops it on skip, cancel or a dead publisher
+            rc = await proc.wait()
+            await asyncio.gather(stderr_task, return_exceptions=True)
+            if self._feed_proc is proc: self._feed_proc = None
+
+        if last_time[0] > 0 or sent:
+            # A killed feeder may have sent up to one progress period past its last report
+            self._ts_offset += last_time[0] + (FEED_PROGRESS_PERIOD if rc != 0 else FEED_FRAME_GAP)
+        if rc != 0 and sent == 0 and not self._skipped:
+            link_cache.invalidate(item['path'])
+            self.log.write(f"[feeder] {item['name']} 读取失败 (code {rc})\n")
+            self.feed_errors += 1
+            return False
+        return True
+
+    async def _read_feed_log(self, proc, last_time):
+        """Feeder stderr: progress lines track its clock, the rest goes to the session log"""
+        while True:
+            try: line = await proc.stderr.readline()
+            except ValueError: continue
+            if not line: break
+            text = line.decode('utf-8', errors='ignore')
+            if FEED_PROGRESS_RE.match(text):
+                key, _, value = text.strip().partition("=")
+                if key == 'out_time_us':
+                    try: last_time[0] = max(last_time[0], int(value) / 1_000_000)
+                    except ValueError: pass
+                continue
+            self.log.write(f"[feeder] {text}")
+
+    async def stop(self, timeout=STREAM_STOP_TIMEOUT):
+        self.state = 'stopping'
+        self._stop_feeder()
+        await super().stop(timeout)
+
+    async def _recover(self, reason):
+        self._stop_feeder()
+        self.current_index = max(0, self.current_index) # Playing item may have just been removed
+        await super()._recover(reason)
+
+    def _cleanup(self):
+        self._stop_feeder()
+        super()._cleanup()
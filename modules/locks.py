@@ -0,0 +1,51 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+
+class KeyedLocks:
+    """One asyncio.Lock per key, dropped again once nobody holds or waits for it"""
+    def __init__(self):
+        self._locks = {} # key -> [lock, holders + waiters]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        slot = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]: self._locks.pop(key, None)
+
+    @asynccontextmanager
+    async def hold_many(self, keys):
+        """Several keys at once, always taken in sorted order so two holders cannot deadlock"""
+        async with self._hold_sorted(sorted(set(keys))):
+            yield
+
+    @asynccontextmanager
+    async def _hold_sorted(self, keys):
+        if not keys:
+            yield
+            return
+        async with self.hold(keys[0]):
+            async with self._hold_sorted(keys[1:]):
+                yield
+
+    def locked(self, key):
+        slot = self._locks.get(key)
+        return bool(slot and slot[0].locked())
+
+# Per Telegram user: handlers touching context.user_data run one at a time
+user_locks = KeyedLocks()
+
+def per_user(handler):
+    """Run a handler holding its user's lock, so one user's updates apply in order"""
+    @functools.wraps(handler)
+    async def wrapper(update, context, *args, **kwargs):
+        user = update.effective_user
+        if user is None: return await handler(update, context, *args, **kwargs)
+        async with user_locks.hold(user.id):
+            return await handler(update, context, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+import aiohttp
+from .config import (
+    MEDIA_CACHE_ENABLED, MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_MAX_FILE_BYTES,
+    MEDIA_CACHE_DOWNLOADS, HTTP_PROXY, HTTPS_PROXY
+)
+from .resolver import resolve_item
+
+logger = logging.getLogger("MediaCache")
+
+# Names this cache creates: <sha1>[.ext][.part]
+CACHE_FILE_RE = re.compile(r"^[0-9a-f]{40}(\.[^/]*)?$")
+
+class MediaCache:
+    """
+    Size-capped directory of downloaded playlist files, keyed by AList path +
+    size + modified and evicted least-recently-used first. Misses are fetched
+    in the background so the next session plays the local copy. Files pinned
+    by a running session are never evicted.
+    """
+    def __init__(self, root=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES,
+                 max_file_bytes=MEDIA_CACHE_MAX_FILE_BYTES, enabled=MEDIA_CACHE_ENABLED):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.enabled = enabled
+        self.index_file = os.path.join(root, "index.json")
+        self._index = None # key -> {'file', 'size', 'path'}, LRU order (oldest first)
+        self._pins = {} # owner -> set of keys
+        self._downloading = {} # key -> task
+        self._sem = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(entry):
+        ident = f"{entry['path']}|{entry.get('size')}|{entry.get('modified')}"
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if self._index is not None: return
+        self._index = OrderedDict()
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for key, meta in saved:
+                if os.path.exists(os.path.join(self.root, meta['file'])):
+                    self._index[key] = meta
+        except FileNotFoundError: pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Media cache index unreadable, rebuilding: {e}")
+        # Drop interrupted downloads and files the index no longer knows
+        known = {meta['file'] for meta in self._index.values()}
+        for name in os.listdir(self.root):
+            if CACHE_FILE_RE.match(name) and name not in known:
+                try: os.remove(os.path.join(self.root, name))
+                except OSError: pass
+
+    def _save(self):
+        tmp = f"{self.index_file}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(list(self._index.items()), f, ensure_ascii=False)
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            logger.error(f"Cannot write media cache index: {e}")
+
+    @property
+    def used_bytes(self):
+        self._load()
+        return sum(meta['size'] for meta in self._index.values())
+
+    def stats(self):
+        self._load()
+        lookups = self.hits + self.misses
+        return {
+            'files': len(self._index),
+            'bytes': self.used_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'downloading': len(self._downloading),
+        }
+
+    # --- Lookup ---
+
+    def localize(self, entry, owner=None, fetch=True):
+        """
+        The entry pointing at the local copy when cached (a new dict, the resolver's
+        entry is shared); otherwise the entry itself, queueing a background download.
+        """
+        if not self.enabled: return entry
+        if not entry.get('url', '').startswith(("http://", "https://")): return entry # Already on this disk
+        self._load()
+        key = self.key(entry)
+        meta = self._index.get(key)
+        if meta:
+            self._index.move_to_end(key)
+            self.hits += 1
+            if owner is not None: self._pins.setdefault(owner, set()).add(key)
+            return {**entry, 'url': os.path.join(self.root, meta['file']), 'cached': True}
+        self.misses += 1
+        if fetch: self._schedule(key, entry)
+        return entry
+
+    def localize_all(self, entries, owner=None):
+        local = [self.localize(e, owner) for e in entries]
+        if self.enabled: self._save() # Persist the LRU order
+        return local
+
+    def release(self, owner):
+        self._pins.pop(owner, None)
+
+    # --- Background download ---
+
+    def _schedule(self, key, entry):
+        size = entry.get('size') or 0
+        if key in self._downloading or size > self.max_file_bytes: return
+        if self._sem is None: self._sem = asyncio.Semaphore(max(1, MEDIA_CACHE_DOWNLOADS))
+        task = asyncio.get_running_loop().create_task(self._download(key, entry))
+        self._downloading[key] = task
+
+    async def _download(self, key, entry):
+        ext = os.path.splitext(entry['name'])[1][:10]
+        name = f"{key}{ext}"
+        target = os.path.join(self.root, name)
+        part = f"{target}.part"
+        try:
+            async with self._sem:
+                fresh = await resolve_item(entry)
+                url = fresh['url']
+                if not url.startswith(("http://", "https://")): return
+                proxy = (HTTPS_PROXY or HTTP_PROXY) if url.startswith("https://") else HTTP_PROXY
+                timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+                written = 0
+                async with aiohttp.ClientSession(timeout=timeout) as client:
+                    async with client.get(url, proxy=proxy) as resp:
+                        if resp.status != 200: raise RuntimeError(f"HTTP {resp.status}")
+                        expected = resp.content_length or entry.get('size')
+                        if expected and expected > self.max_file_bytes: return
+                        if expected and not self._make_room(expected): return
+                        loop = asyncio.get_running_loop()
+                        with open(part, 'wb') as f:
+                            async for chunk in resp.content.iter_chunked(256 * 1024):
+                                await loop.run_in_executor(None, f.write, chunk) # Slow flash storage
+                                written += len(chunk)
+                                if written > self.max_file_bytes: raise RuntimeError("超过单文件缓存上限")
+                if expected and written != expected:
+                    raise RuntimeError(f"incomplete ({written}/{expected})")
+                if not self._make_room(written): return
+                os.replace(part, target)
+                self._index[key] = {'file': name, 'size': written, 'path': entry['path']}
+                self._save()
+                logger.info(f"Cached {entry['path']} ({written} bytes)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Caching {entry['path']} failed: {e}")
+        finally:
+            self._downloading.pop(key, None)
+            if os.path.exists(part):
+                try: os.remove(part)
+                except OSError: pass
+
+    def _make_room(self, incoming):
+        """Evict least recently used, unpinned files until `incoming` bytes fit; False if they cannot"""
+        pinned = set().union(*self._pins.values()) if self._pins else set()
+        used = self.used_bytes
+        for key in list(self._index):
+            if used + incoming <= self.max_bytes: break
+            if key in pinned: continue
+            meta = self._index.pop(key)
+            try: os.remove(os.path.join(self.root, meta['file']))
+            except OSError: pass
+            used -= meta['size']
+        self._save()
+        return used + incoming <= self.max_bytes
+
+    async def close(self):
+        for task in list(self._downloading.values()): task.cancel()
+        await asyncio.gather(*self._downloading.values(), return_exceptions=True)
+
+# Singleton
+media_cache = MediaCache()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from telegram.error import BadRequest, RetryAfter
+from .config import EDIT_MIN_INTERVAL, EDIT_CHAT_RATE, EDIT_CHAT_BURST, EDIT_GLOBAL_RATE
+
+logger = logging.getLogger("MsgEdit")
+
+# Messages whose last sent state is remembered (to skip unchanged edits)
+REMEMBER_MESSAGES = 1000
+
+def _seconds(value):
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version"""
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+class TokenBucket:
+    """`rate` sends per second with bursts of `burst`; a flood wait blocks it outright"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self):
+        """Seconds until a send may go out (0 = now)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = self.blocked_until - now
+        if self.tokens < 1: wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(0.0, wait)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class MessageEditor:
+    """
+    All edits of bot messages go through here. Per message only the newest
+    requested state is sent (edits arriving within EDIT_MIN_INTERVAL of the
+    last one are coalesced), states identical to what the message already
+    shows are dropped, and sends wait for a global and a per-chat budget.
+    Flood waits (RetryAfter) pause the chat and re-queue the edit.
+    """
+    def __init__(self, min_interval=EDIT_MIN_INTERVAL, chat_rate=EDIT_CHAT_RATE,
+                 chat_burst=EDIT_CHAT_BURST, global_rate=EDIT_GLOBAL_RATE):
+        self.min_interval = min_interval
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, max(1, global_rate))
+        self._chat_buckets = {} # chat_id -> TokenBucket
+        self._pending = {} # (chat_id, message_id) -> (state, [waiting futures])
+        self._sent = OrderedDict() # (chat_id, message_id) -> (fingerprint, monotonic time)
+        self._tasks = {} # (chat_id, message_id) -> flush task
+        self.coalesced = 0
+        self.unchanged = 0
+
+    @staticmethod
+    def fingerprint(text, reply_markup, parse_mode):
+        return (text, parse_mode, reply_markup.to_json() if reply_markup is not None else None)
+
+    async def edit(self, bot, chat_id, message_id, text, reply_markup=None, parse_mode=None, wait=False):
+        """
+        Queue an edit. Returns at once unless `wait`, in which case it returns
+        True once this state (or a newer one) is shown and raises if Telegram
+        rejects it. Without `wait` failures are only logged.
+        """
+        key = (chat_id, message_id)
+        state = (bot, text, reply_markup, parse_mode, self.fingerprint(text, reply_markup, parse_mode))
+        fut = asyncio.get_running_loop().create_future() if wait else None
+
+        pending = self._pending.get(key)
+        if pending:
+            self.coalesced += 1
+            self._pending[key] = (state, pending[1] + ([fut] if fut else []))
+        elif key not in self._tasks and self._sent.get(key, (None,))[0] == state[4]:
+            self.unchanged += 1
+            return True
+        else:
+            self._pending[key] = (state, [fut] if fut else [])
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._flush(key))
+        if fut: return await fut
+        return None
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id):
+        chat = self._bucket(chat_id)
+        while True:
+            wait = max(self.global_bucket.delay(), chat.delay())
+            if wait <= 0:
+                self.global_bucket.take()
+                chat.take()
+                return
+            await asyncio.sleep(wait)
+
+    def _remember(self, key, fp):
+        self._sent.pop(key, None)
+        self._sent[key] = (fp, time.monotonic())
+        while len(self._sent) > REMEMBER_MESSAGES:
+            self._sent.popitem(last=False)
+
+    @staticmethod
+    def _settle(futures, error=None):
+        for fut in futures:
+            if fut.done(): continue
+            if error: fut.set_exception(error)
+            else: fut.set_result(True)
+
+    async def _flush(self, key):
+        chat_id, message_id = key
+        try:
+            while key in self._pending:
+                # Let a burst of edits to this message collapse into the last one
+                last = self._sent.get(key)
+                if last:
+                    wait = last[1] + self.min_interval - time.monotonic()
+                    if wait > 0: await asyncio.sleep(wait)
+                await self._acquire(chat_id)
+
+                state, futures = self._pending.pop(key) # Newest state as of now
+                bot, text, reply_markup, parse_mode, fp = state
+                if self._sent.get(key, (None,))[0] == fp:
+                    self.unchanged += 1
+                    self._settle(futures)
+                    continue
+                try:
+                    await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                                                reply_markup=reply_markup, parse_mode=parse_mode)
+                    self._remember(key, fp)
+                    self._settle(futures)
+                except RetryAfter as e:
+                    delay = _seconds(e.retry_after)
+                    logger.warning(f"Flood wait {delay:g}s for chat {chat_id}, edit queued")
+                    self._bucket(chat_id).block(delay)
+                    # Retry unless a newer state replaced it meanwhile (that one inherits the waiters)
+                    newer = self._pending.get(key)
+                    self._pending[key] = (newer[0], futures + newer[1]) if newer else (state, futures)
+                except BadRequest as e:
+                    if "not modified" in str(e).lower():
+                        self._remember(key, fp)
+                        self._settle(futures)
+                    else:
+                        logger.warning(f"Edit of message {message_id} in chat {chat_id} failed: {e}")
+                        self._settle(futures, e)
+                except Exception as e:
+                    logger.warning(f"Edit of message {message_id} in chat {chat_id} failed: {e!r}")
+                    self._settle(futures, e)
+        except asyncio.CancelledError:
+            _, futures = self._pending.pop(key, (None, []))
+            for fut in futures: fut.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Singleton
+message_editor = MessageEditor()
+
+async def edit_message(message, text, reply_markup=None, parse_mode=None, wait=False):
+    """Edit a bot message (e.g. `query.message`) through the shared editor"""
+    return await message_editor.edit(
+        message.get_bot(), message.chat.id, message.message_id,
+        text, reply_markup=reply_markup, parse_mode=parse_mode, wait=wait
+    )
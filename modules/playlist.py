@@ -0,0 +1,55 @@
+class Playlist:
+    """
+    Ordered playlist indexed by AList path.
+    Membership, add, remove and toggle are O(1); iteration keeps selection
+    order and yields {'path', 'name'} dicts like the old list-based playlist.
+    """
+    def __init__(self, items=None):
+        self._items = {} # path -> {'path', 'name'}
+        for item in items or []:
+            self.add(item['path'], item.get('name'))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __contains__(self, path):
+        return path in self._items
+
+    def add(self, path, name=None):
+        """Append if missing; returns True when added"""
+        if path in self._items: return False
+        self._items[path] = {'path': path, 'name': name or path.rsplit('/', 1)[-1]}
+        return True
+
+    def remove(self, path):
+        return self._items.pop(path, None) is not None
+
+    def toggle(self, path, name=None):
+        """Returns True if the path is selected afterwards"""
+        if self.remove(path): return False
+        self.add(path, name)
+        return True
+
+    def extend(self, items):
+        """Append many {'path', 'name'} dicts; returns how many were new"""
+        return sum(1 for item in items if self.add(item['path'], item.get('name')))
+
+    def clear(self):
+        self._items.clear()
+
+    def items(self):
+        return list(self._items.values())
+
+def get_playlist(user_data):
+    """The user's Playlist, upgrading a legacy list in place"""
+    playlist = user_data.get('playlist')
+    if not isinstance(playlist, Playlist):
+        playlist = Playlist(playlist or [])
+        user_data['playlist'] = playlist
+    return playlist
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from .config import PROBE_CONCURRENCY, PROBE_TIMEOUT, PROBE_CACHE_FILE, PROBE_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger("Probe")
+
+# What FLV/RTMP can carry without re-encoding
+FLV_VIDEO_CODECS = ('h264',)
+FLV_AUDIO_CODECS = ('aac', 'mp3')
+
+def parse_rate(value):
+    """'30000/1001' -> 29.97"""
+    try:
+        num, _, den = str(value).partition("/")
+        return round(float(num) / float(den or 1), 2)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def summarize(data):
+    """ffprobe JSON -> the fields that decide concat/copy compatibility"""
+    info = {'duration': None, 'video': None, 'audio': None}
+    try: info['duration'] = float(data.get('format', {}).get('duration'))
+    except (TypeError, ValueError): pass
+    for st in data.get('streams', []):
+        kind = st.get('codec_type')
+        if kind == 'video' and info['video'] is None and not st.get('disposition', {}).get('attached_pic'):
+            info['video'] = {
+                'codec': st.get('codec_name'),
+                'width': st.get('width'),
+                'height': st.get('height'),
+                'fps': parse_rate(st.get('avg_frame_rate')) or parse_rate(st.get('r_frame_rate')),
+                'pix_fmt': st.get('pix_fmt'),
+            }
+        elif kind == 'audio' and info['audio'] is None:
+            try: rate = int(st.get('sample_rate'))
+            except (TypeError, ValueError): rate = None
+            info['audio'] = {'codec': st.get('codec_name'), 'sample_rate': rate, 'channels': st.get('channels')}
+    return info
+
+def cache_key(entry):
+    return f"{entry['path']}|{entry.get('size')}|{entry.get('modified')}"
+
+class ProbeCache:
+    """
+    ffprobe summaries persisted as JSON, keyed by AList path + size + modified
+    so a replaced file is probed again. Oldest entries go first past max_entries.
+    """
+    def __init__(self, path=PROBE_CACHE_FILE, max_entries=PROBE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._data = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._data is not None: return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._data = data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            self._data = {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read {self.path}, starting empty: {e}")
+            self._data = {}
+
+    def get(self, entry):
+        with self._lock:
+            self._load()
+            return self._data.get(cache_key(entry))
+
+    def put(self, entry, info):
+        with self._lock:
+            self._load()
+            key = cache_key(entry)
+            self._data.pop(key, None)
+            self._data[key] = info
+            while len(self._data) > self.max_entries:
+                self._data.pop(next(iter(self._data)))
+            self._dirty = True
+
+    def save(self):
+        """Atomic write (temp file + fsync + rename), only if something changed"""
+        with self._lock:
+            if not self._dirty: return
+            tmp = f"{self.path}.tmp"
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(self._data, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                self._dirty = False
+            except OSError as e:
+                logger.error(f"Cannot write {self.path}: {e}")
+
+# Global Probe Cache
+probe_cache = ProbeCache()
+
+async def probe_url(url, env=None, timeout=PROBE_TIMEOUT):
+    """ffprobe a (remote) URL; returns the summary or raises RuntimeError"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        url
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        try: proc.kill()
+        except ProcessLookupError: pass
+        await proc.wait()
+        raise RuntimeError(f"ffprobe 超时 ({timeout:g}s)")
+    if proc.returncode != 0:
+        reason = err.decode('utf-8', errors='ignore').strip().splitlines()
+        raise RuntimeError(reason[-1] if reason else f"ffprobe code {proc.returncode}")
+    try: return summarize(json.loads(out or b"{}"))
+    except ValueError as e: raise RuntimeError(f"ffprobe 输出无法解析: {e}")
+
+async def probe_playlist(entries, env=None, concurrency=PROBE_CONCURRENCY, on_progress=None):
+    """
+    Probe resolved entries (cache first, at most `concurrency` ffprobes in flight).
+    Sets entry['probe'] (summary or None) and returns {path: error} for failures.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    errors = {}
+    total = len(entries)
+    done = 0
+
+    async def worker(entry):
+        nonlocal done
+        info = probe_cache.get(entry)
+        if info is None:
+            async with sem:
+                try:
+                    info = await probe_url(entry['url'], env)
+                    probe_cache.put(entry, info)
+                except FileNotFoundError:
+                    raise # No ffprobe binary: abort the whole stage
+                except Exception as e:
+                    errors[entry['path']] = str(e)
+        entry['probe'] = info
+        done += 1
+        if on_progress:
+            try: await on_progress(done, total)
+            except Exception: pass
+
+    try:
+        await asyncio.gather(*(worker(e) for e in entries))
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, probe_cache.save)
+    return errors
+
+def signature(info):
+    """Properties that must match across items for concat + stream copy"""
+    v, a = info.get('video') or {}, info.get('audio') or {}
+    return (
+        v.get('codec'), v.get('width'), v.get('height'), v.get('fps'), v.get('pix_fmt'),
+        a.get('codec'), a.get('sample_rate'), a.get('channels')
+    )
+
+SIGNATURE_LABELS = ("视频编码", "宽", "高", "帧率", "像素格式", "音频编码", "采样率", "声道")
+
+def check_compat(entries):
+    """
+    Decide copy vs normalize per entry from entry['probe'].
+    The reference profile is the most common signature among FLV-compatible
+    files. Sets entry['copy_ok'] / entry['compat_issues'] and returns
+    (reference signature or None, total duration in seconds).
+    """
+    def flv_ok(info):
+        v, a = info.get('video'), info.get('audio')
+        return (v is None or v.get('codec') in FLV_VIDEO_CODECS) and (a is None or a.get('codec') in FLV_AUDIO_CODECS)
+
+    probed = [e for e in entries if e.get('probe')]
+    counts = Counter(signature(e['probe']) for e in probed if flv_ok(e['probe']))
+    reference = counts.most_common(1)[0][0] if counts else None
+    duration = sum((e['probe'].get('duration') or 0) for e in probed)
+
+    for e in entries:
+        info = e.get('probe')
+        issues = []
+        if info is None:
+            issues.append("无法探测")
+        else:
+            v, a = info.get('video'), info.get('audio')
+            if v and v.get('codec') not in FLV_VIDEO_CODECS: issues.append(f"视频编码 {v.get('codec')} 不支持直推")
+            if a and a.get('codec') not in FLV_AUDIO_CODECS: issues.append(f"音频编码 {a.get('codec')} 不支持直推")
+            if reference and not issues:
+                for label, mine, ref in zip(SIGNATURE_LABELS, signature(info), reference):
+                    if mine != ref: issues.append(f"{label} {mine} ≠ {ref}")
+        e['copy_ok'] = not issues
+        e['compat_issues'] = issues
+    return reference, duration
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import re
+import secrets
+import urllib.parse
+import aiohttp
+from aiohttp import web
+from .config import (
+    RELAY_HOST, RELAY_PORT, RELAY_BUFFER_BYTES, RELAY_CHUNK, RELAY_RETRIES,
+    RELAY_READ_TIMEOUT, RELAY_PREOPEN_TTL, HTTP_PROXY, HTTPS_PROXY
+)
+from .resolver import resolve_item, link_cache
+
+logger = logging.getLogger("Relay")
+
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+def parse_range(header):
+    """'bytes=100-' -> (100, None); only single ranges, like ffmpeg sends"""
+    m = RANGE_RE.fullmatch((header or "").strip())
+    if not m: return 0, None
+    return int(m.group(1)), int(m.group(2)) if m.group(2) else None
+
+class RelayStream:
+    """
+    One upstream read from `start` (to `end` inclusive, or EOF) pumped into a
+    bounded queue. Upstream errors are resumed with a Range request from the
+    next missing byte, re-resolving the link when the provider rejects it.
+    """
+    def __init__(self, relay, item, start=0, end=None):
+        self.relay = relay
+        self.item = item
+        self.start = start
+        self.end = end
+        self.pos = start # Next byte to fetch
+        self.total = None
+        self.content_type = None
+        self.queue = asyncio.Queue(maxsize=max(1, RELAY_BUFFER_BYTES // RELAY_CHUNK))
+        self._resp = None
+        self._task = None
+        self._opened = None
+
+    async def _connect(self):
+        """Open upstream at self.pos; raises on failure"""
+        for attempt in range(2):
+            entry = await resolve_item(self.item)
+            headers = {"Range": f"bytes={self.pos}-{'' if self.end is None else self.end}"}
+            url = entry['url']
+            resp = await self.relay.client().get(url, headers=headers, proxy=self.relay.proxy_for(url))
+            if resp.status in (200, 206):
+                return resp
+            resp.release()
+            if resp.status in (401, 403, 404, 410) and attempt == 0:
+                link_cache.invalidate(self.item['path']) # Expired signature: get a fresh link
+                continue
+            raise RuntimeError(f"upstream HTTP {resp.status}")
+
+    async def open(self):
+        """Connect and learn the size; safe to await more than once"""
+        if self._opened is None:
+            self._opened = asyncio.ensure_future(self._open())
+        await asyncio.shield(self._opened)
+
+    async def _open(self):
+        self._resp = await self._connect()
+        self.content_type = self._resp.headers.get('Content-Type')
+        m = CONTENT_RANGE_RE.match(self._resp.headers.get('Content-Range', ''))
+        if self._resp.status == 206 and m and m.group(3) != '*':
+            self.total = int(m.group(3))
+        elif self._resp.status == 200 and self._resp.content_length is not None:
+            self.total = self._resp.content_length
+        self._task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _pump(self):
+        retries = 0
+        resp = self._resp
+        try:
+            while True:
+                try:
+                    if resp is None: resp = self._resp = await self._connect()
+                    # A server that ignored the Range replays from byte 0: skip what we already have
+                    skip = self.pos if resp.status == 200 else 0
+                    async for chunk in resp.content.iter_chunked(RELAY_CHUNK):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk, skip = chunk[skip:], 0
+                        if self.end is not None:
+                            chunk = chunk[:max(0, self.end + 1 - self.pos)]
+                        if not chunk: break
+                        await self.queue.put(chunk) # Blocks once RELAY_BUFFER_BYTES are buffered
+                        self.pos += len(chunk)
+                    resp.release()
+                    goal = self.end + 1 if self.end is not None else self.total
+                    if goal is None or self.pos >= goal: break
+                    raise aiohttp.ClientPayloadError(f"upstream ended at {self.pos}/{goal}")
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    if resp: resp.release()
+                    resp = None
+                    retries += 1
+                    if retries > RELAY_RETRIES: raise
+                    logger.warning(f"Relay {self.item['name']}: {e!r}, resuming at byte {self.pos} ({retries}/{RELAY_RETRIES})")
+                    await asyncio.sleep(min(5, 0.5 * 2 ** (retries - 1)))
+            await self.queue.put(None)
+        except asyncio.CancelledError:
+            if resp: resp.release()
+            raise
+        except Exception as e:
+            logger.error(f"Relay {self.item['name']} gave up at byte {self.pos}: {e!r}")
+            await self.queue.put(e)
+
+    async def chunks(self):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None: return
+            if isinstance(chunk, Exception): raise chunk
+            yield chunk
+
+    def close(self):
+        if self._task: self._task.cancel()
+        if self._opened and not self._opened.done(): self._opened.cancel()
+        if self._resp: self._resp.release()
+
+class MediaRelay:
+    """
+    Local HTTP server ffmpeg reads playlist items from (http://127.0.0.1:<port>/r/<token>/<name>).
+    Each item is fetched upstream with a bounded read-ahead buffer and Range
+    resume; while one item is being served the next one is pre-opened so the
+    concat boundary does not wait for a fresh connection.
+    """
+    def __init__(self, host=RELAY_HOST, port=RELAY_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+        self._client = None
+        self._tokens = {} # token -> {'item', 'next', 'owner'}
+        self._owners = {} # owner -> [tokens]
+        self._preopened = {} # token -> [RelayStream, expiry handle or None, requests holding it]
+
+    @property
+    def running(self):
+        return self._runner is not None
+
+    def client(self):
+        if self._client is None or self._client.closed:
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=RELAY_READ_TIMEOUT)
+            self._client = aiohttp.ClientSession(timeout=timeout, auto_decompress=False)
+        return self._client
+
+    @staticmethod
+    def proxy_for(url):
+        if url.startswith("https://"): return HTTPS_PROXY or HTTP_PROXY
+        return HTTP_PROXY
+
+    async def start(self):
+        if self._runner: return
+        app = web.Application()
+        app.router.add_route('GET', '/r/{token}/{name:.*}', self.handle)
+        app.router.add_route('HEAD', '/r/{token}/{name:.*}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        self.port = runner.addresses[0][1] # Actual port when RELAY_PORT is 0
+        self._runner = runner
+        logger.info(f"Media relay listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        for token in list(self._preopened): self._drop_preopened(token)
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._client and not self._client.closed:
+            await self._client.close()
+        self._client = None
+
+    # --- Registration ---
+
+    def register_playlist(self, owner, entries):
+        """
+        Replace the owner's relay tokens with ones for `entries` (in play order)
+        and return the URLs ffmpeg should read. Non-HTTP sources pass through.
+        """
+        # Tokens of items still listed are kept, so a pre-opened next item survives re-registration
+        old = {self._tokens[t]['item']['path']: t for t in self._owners.pop(owner, []) if t in self._tokens}
+        if not self.running: return [e['url'] for e in entries]
+        urls, tokens = [], []
+        for entry in entries:
+            if not entry['url'].startswith(("http://", "https://")):
+                urls.append(entry['url'])
+                tokens.append(None)
+                continue
+            token = old.pop(entry['path'], None) or secrets.token_urlsafe(9)
+            self._tokens[token] = {'item': {'path': entry['path'], 'name': entry['name']}, 'next': None, 'owner': owner}
+            tokens.append(token)
+            name = urllib.parse.quote(entry['name'].replace('/', '_'))
+            urls.append(f"http://{self.host}:{self.port}/r/{token}/{name}")
+        for cur, nxt in zip(tokens, tokens[1:]):
+            if cur and nxt: self._tokens[cur]['next'] = nxt
+        self._owners[owner] = [t for t in tokens if t]
+        for token in old.values():
+            self._tokens.pop(token, None)
+            self._drop_preopened(token)
+        return urls
+
+    def release(self, owner):
+        for token in self._owners.pop(owner, []):
+            self._tokens.pop(token, None)
+            self._drop_preopened(token)
+
+    # --- Pre-opening ---
+
+    def _preopen(self, token):
+        """Pre-open `token` for a request serving its predecessor; kept until _unhold() plus the TTL"""
+        slot = self._tokens.get(token)
+        if not slot: return
+        hit = self._preopened.get(token)
+        if hit:
+            if hit[1]: hit[1].cancel()
+            hit[1] = None
+            hit[2] += 1
+            return
+        stream = RelayStream(self, slot['item'])
+        self._preopened[token] = [stream, None, 1]
+
+        async def warm():
+            try: await stream.open()
+            except Exception as e:
+                logger.warning(f"Pre-open of {slot['item']['name']} failed: {e!r}")
+                self._drop_preopened(token)
+
+        asyncio.get_running_loop().create_task(warm())
+
+    def _unhold(self, token):
+        """The predecessor's request ended: an unused pre-open now expires after RELAY_PREOPEN_TTL"""
+        hit = self._preopened.get(token)
+        if not hit: return
+        hit[2] -= 1
+        if hit[2] <= 0 and hit[1] is None:
+            hit[1] = asyncio.get_running_loop().call_later(RELAY_PREOPEN_TTL, self._drop_preopened, token)
+
+    def _take_preopened(self, token, start, end):
+        hit = self._preopened.get(token)
+        if not hit or start != 0 or end is not None: return None
+        stream, expiry, _ = self._preopened.pop(token)
+        if expiry: expiry.cancel()
+        return stream
+
+    def _drop_preopened(self, token):
+        hit = self._preopened.pop(token, None)
+        if hit:
+            stream, expiry, _ = hit
+            if expiry: expiry.cancel()
+            stream.close()
+
+    # --- Serving ---
+
+    async def handle(self, request):
+        token = request.match_info['token']
+        slot = self._tokens.get(token)
+        if not slot: raise web.HTTPNotFound()
+
+        start, end = parse_range(request.headers.get('Range'))
+        stream = self._take_preopened(token, start, end) or RelayStream(self, slot['item'], start, end)
+        try:
+            await stream.open()
+        except Exception as e:
+            stream.close()
+            logger.error(f"Relay cannot open {slot['item']['name']}: {e!r}")
+            raise web.HTTPBadGateway()
+
+        headers = {'Accept-Ranges': 'bytes', 'Content-Type': stream.content_type or 'application/octet-stream'}
+        status = 200
+        length = None
+        if stream.total is not None:
+            last = min(end, stream.total - 1) if end is not None else stream.total - 1
+            length = max(0, last - start + 1)
+            headers['Content-Length'] = str(length)
+            if 'Range' in request.headers:
+                status = 206
+                headers['Content-Range'] = f"bytes {start}-{last}/{stream.total}"
+        response = web.StreamResponse(status=status, headers=headers)
+        preopened = None # Next item's token once this request pre-opened it
+        # A request starting near the end (e.g. ffmpeg seeking to an MP4 moov atom) is a probe, not playback
+        tail_probe = stream.total is not None and start > 0 and stream.total - start <= RELAY_BUFFER_BYTES
+        try:
+            await response.prepare(request)
+            if request.method == 'HEAD': return response
+            sent = 0
+            async for chunk in stream.chunks():
+                await response.write(chunk)
+                sent += len(chunk)
+                # Close to the end of the item (not just of this range): get the next one connecting, once
+                if (not preopened and slot['next'] and not tail_probe and stream.total is not None
+                        and start + sent >= stream.total - RELAY_BUFFER_BYTES):
+                    preopened = slot['next']
+                    self._preopen(preopened)
+            if not preopened and slot['next'] and stream.total is None:
+                preopened = slot['next']
+                self._preopen(preopened)
+        except ConnectionResetError:
+            pass # ffmpeg closed the connection (seek, skip or stop)
+        except Exception as e:
+            logger.error(f"Relay stream {slot['item']['name']} failed: {e!r}")
+        finally:
+            stream.close()
+            if preopened: self._unhold(preopened)
+        return response
+
+# Singleton
+relay = MediaRelay()
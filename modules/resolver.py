@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import os
+import posixpath
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from .config import LINK_CACHE_TTL, RESOLVE_CONCURRENCY, LOCAL_FASTPATH, LOCAL_MOUNTS_TTL
+from .accounts import alist_mgr
+
+logger = logging.getLogger("Resolver")
+
+# Links are dropped this many seconds before they actually expire
+EXPIRY_MARGIN = 60
+
+def _link_expiry(url, sign=None):
+    """Best-effort absolute expiry (epoch) of a direct link, None if unknown"""
+    candidates = []
+
+    # AList sign: "<hmac>:<expire>", expire 0 means permanent
+    if sign and ":" in sign:
+        try:
+            exp = int(sign.rsplit(":", 1)[1])
+            if exp > 0: candidates.append(exp)
+        except ValueError: pass
+
+    try: query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+    except ValueError: query = {}
+    lowered = {k.lower(): v for k, v in query.items()}
+
+    # Absolute epoch style (OSS, CloudFront, most CDN signers)
+    for key in ('expires', 'x-oss-expires', 'e', 'x-expires'):
+        val = lowered.get(key, '')
+        if val.isdigit() and int(val) > 1_000_000_000:
+            candidates.append(int(val))
+            break
+
+    # S3 SigV4 style: X-Amz-Date + X-Amz-Expires (relative seconds)
+    amz_date, amz_exp = lowered.get('x-amz-date'), lowered.get('x-amz-expires', '')
+    if amz_date and amz_exp.isdigit():
+        try:
+            start = datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+            candidates.append(int(start.timestamp()) + int(amz_exp))
+        except ValueError: pass
+
+    return min(candidates) if candidates else None
+
+def build_direct_url(data):
+    """raw_url from /api/fs/get with the AList sign appended"""
+    raw_url = data['raw_url']
+    # Fix URL appending logic: Check if ? exists
+    if data.get('sign'):
+        separator = "&" if "?" in raw_url else "?"
+        raw_url += f"{separator}sign={data['sign']}"
+    return raw_url
+
+class LinkCache:
+    """Resolved direct links keyed by AList path, honouring link expiry"""
+    def __init__(self, default_ttl=LINK_CACHE_TTL):
+        self.default_ttl = default_ttl
+        self._links = {} # path -> (entry, expires_at)
+
+    def get(self, path):
+        hit = self._links.get(path)
+        if not hit: return None
+        entry, expires_at = hit
+        if time.time() >= expires_at:
+            del self._links[path]
+            return None
+        return entry
+
+    def put(self, path, entry, sign=None):
+        expires_at = time.time() + self.default_ttl
+        link_exp = _link_expiry(entry['url'], sign)
+        if link_exp:
+            expires_at = min(expires_at, link_exp - EXPIRY_MARGIN)
+        if expires_at > time.time():
+            self._links[path] = (entry, expires_at)
+
+    def invalidate(self, path):
+        self._links.pop(path, None)
+
+    def clear(self):
+        self._links.clear()
+
+# Global Link Cache
+link_cache = LinkCache()
+
+class LocalMounts:
+    """
+    AList storages backed by the Local driver, read from the admin storage
+    table, so files on this host's own disk can be opened directly instead of
+    through AList's web server. Only roots that exist here are used (AList may
+    run on another machine or in a container with different paths).
+    """
+    def __init__(self, enabled=LOCAL_FASTPATH, ttl=LOCAL_MOUNTS_TTL):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._mounts = [] # (mount_path, root or None for remote drivers), longest mount first
+        self._loaded_at = 0.0
+        self._refreshing = None
+
+    async def _refresh(self):
+        storages = await alist_mgr.list_storages()
+        self._loaded_at = time.monotonic()
+        if storages is None:
+            self._mounts = [] # Not an admin or no such API: everything goes over HTTP
+            return
+        mounts = []
+        for st in storages:
+            if st.get('disabled') or not st.get('mount_path'): continue
+            root = None
+            if st.get('driver') == 'Local':
+                try: addition = json.loads(st.get('addition') or "{}")
+                except ValueError: addition = {}
+                folder = addition.get('root_folder_path')
+                if folder and os.path.isdir(folder): root = folder
+            mounts.append(('/' + st['mount_path'].strip('/'), root))
+        mounts.sort(key=lambda m: len(m[0]), reverse=True)
+        self._mounts = mounts
+        local = [m for m, root in mounts if root]
+        if local: logger.info(f"Local fast path for: {', '.join(local)}")
+
+    async def ensure_loaded(self):
+        if time.monotonic() - self._loaded_at < self.ttl: return
+        # One table fetch for a whole burst of resolves
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        try: await asyncio.shield(self._refreshing)
+        finally:
+            if self._refreshing and self._refreshing.done(): self._refreshing = None
+
+    def to_local(self, path):
+        """Filesystem path for an AList path on a Local storage, None otherwise"""
+        for mount, root in self._mounts:
+            if path == mount or path.startswith(mount.rstrip('/') + '/'):
+                if root is None: return None # A remote storage mounted deeper wins
+                rel = posixpath.normpath(path[len(mount):].lstrip('/') or '.')
+                if rel.startswith('..'): return None
+                return os.path.join(root, rel)
+        return None
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+# Global Local Mount Table
+local_mounts = LocalMounts()
+
+async def resolve_local(item):
+    """Entry with the on-disk file as 'url' when the item lives on a Local storage, else None"""
+    if not local_mounts.enabled: return None
+    try: await local_mounts.ensure_loaded()
+    except Exception as e:
+        logger.warning(f"Storage table unavailable: {e}")
+        return None
+    local = local_mounts.to_local(item['path'])
+    if not local: return None
+    try: st = os.stat(local)
+    except OSError: return None # Not visible from here after all: use HTTP
+    return {
+        'path': item['path'],
+        'name': item.get('name') or posixpath.basename(item['path']),
+        'url': local,
+        'size': st.st_size,
+        'modified': datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat(),
+        'local': True,
+    }
+
+async def resolve_item(item):
+    """Resolve one playlist item to {'path','name','url','size','modified'}; raises on failure"""
+    cached = link_cache.get(item['path'])
+    if cached: return cached
+
+    # Files on this host's disk: no /api/fs/get, no signed link, no HTTP hop
+    entry = await resolve_local(item)
+    if entry:
+        link_cache.put(item['path'], entry)
+        return entry
+
+    resp = await alist_mgr.get_file_info(item['path'])
+    if not resp:
+        raise RuntimeError("AList 无响应")
+    if resp.get('code') != 200:
+        raise RuntimeError(resp.get('message') or f"code {resp.get('code')}")
+    data = resp['data']
+    if not data.get('raw_url'):
+        raise RuntimeError("无直链 (raw_url 为空)")
+
+    entry = {
+        'path': item['path'],
+        'name': item.get('name') or data.get('name'),
+        'url': build_direct_url(data),
+        'size': data.get('size'),
+        'modified': data.get('modified'),
+    }
+    link_cache.put(item['path'], entry, data.get('sign'))
+    return entry
+
+async def resolve_playlist(items, concurrency=RESOLVE_CONCURRENCY, on_progress=None):
+    """
+    Resolve items concurrently (at most `concurrency` in flight).
+    Returns (resolved, failed): resolved keeps playlist order, failed is a
+    list of (item, reason). `on_progress(done, total)` is awaited after each item.
+    """
+    items = list(items)
+    total = len(items)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    results = [None] * total
+    failed = []
+    done = 0
+
+    async def worker(idx, item):
+        nonlocal done
+        async with sem:
+            try:
+                results[idx] = await resolve_item(item)
+            except Exception as e:
+                logger.warning(f"Resolve failed for {item['path']}: {e}")
+                failed.append((idx, item, str(e)))
+        done += 1
+        if on_progress:
+            try: await on_progress(done, total)
+            except Exception: pass
+
+    await asyncio.gather(*(worker(i, it) for i, it in enumerate(items)))
+    failed.sort(key=lambda f: f[0])
+    resolved = [r for r in results if r is not None]
+    return resolved, [(item, reason) for _, item, reason in failed]
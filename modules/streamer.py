@@ -0,0 +1,624 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import re
+import time
+from collections import deque
+from telegram.helpers import escape_markdown
+from .streamlog import SessionLog
+from .config import (
+    STREAM_STOP_TIMEOUT, STREAMS_DIR, MAX_CONCURRENT_STREAMS,
+    MAX_TOTAL_EGRESS_KBPS, STREAM_EST_KBPS, STREAM_QUEUE_MAX,
+    WATCHDOG_ENABLED, WATCHDOG_INTERVAL, WATCHDOG_STALL_SECS, WATCHDOG_MIN_SPEED,
+    WATCHDOG_SLOW_SECS, WATCHDOG_STABLE_SECS, WATCHDOG_MAX_RESTARTS, WATCHDOG_WINDOW,
+    WATCHDOG_BACKOFF, WATCHDOG_BACKOFF_MAX
+)
+from .resolver import resolve_playlist, link_cache
+from .relay import relay
+from .mediacache import media_cache
+from .locks import KeyedLocks
+
+logger = logging.getLogger("Streamer")
+
+# Global Stream State: session name (stream key name) -> StreamSession
+stream_sessions = {}
+# Per stream key: the last session stopped or replaced there, so its log can still be viewed
+finished_sessions = {}
+# Per stream key: starting, replacing and stopping the session on it never interleave
+session_locks = KeyedLocks()
+_session_ids = itertools.count(1)
+
+# ffmpeg logs this (at info level) whenever the concat demuxer opens the next item
+OPENING_RE = re.compile(r"Opening '(.+)' for reading")
+# tee muxer (onfail=ignore) reports a dropped output like this
+TEE_FAILED_RE = re.compile(r"Slave muxer #(\d+) failed")
+TEE_SLAVE_RE = re.compile(r"Slave '(.+?)'")
+# Per-entry results of the probe stage (probe.probe_playlist / check_compat)
+PROBE_KEYS = ('probe', 'copy_ok', 'compat_issues')
+
+def tee_escape(url):
+    """Escape the characters the tee muxer treats as separators"""
+    return re.sub(r"([\\|\[\]])", r"\\\1", url)
+
+def parse_out_time(value):
+    """'00:01:02.500000' -> seconds"""
+    try:
+        h, m, sec = value.split(":")
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    except (ValueError, AttributeError):
+        return None
+
+def parse_kbps(bitrate):
+    """'2500.0kbits/s' -> 2500.0"""
+    try: return float(bitrate.replace('kbits/s', '').strip())
+    except (ValueError, AttributeError): return None
+
+def session_dir(name):
+    """Per-session working directory (name slug + short hash, names may collide after slugging)"""
+    slug = re.sub(r'[^\w.-]+', '_', name).strip('_')[:32] or 'stream'
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(STREAMS_DIR, f"{slug}-{digest}")
+
+class ProgressParser:
+    """Incremental parser for ffmpeg `-progress` key=value blocks"""
+    NUMERIC = ('frame', 'drop_frames', 'dup_frames', 'total_size', 'out_time_us')
+
+    def __init__(self):
+        self.current = {}
+        self.latest = {}
+
+    def feed(self, line):
+        """Feed one line; returns the completed block at each 'progress=' marker"""
+        key, sep, value = line.strip().partition("=")
+        if not sep: return None
+        if key != 'progress':
+            self.current[key] = value.strip()
+            return None
+
+        block, self.current = self.current, {}
+        snap = {'state': value.strip(), 'updated_at': time.time()}
+        for k in self.NUMERIC:
+            try: snap[k] = int(block[k])
+            except (KeyError, ValueError): pass
+        try: snap['fps'] = float(block.get('fps', ''))
+        except ValueError: pass
+        speed = block.get('speed', '').rstrip('x').strip()
+        try: snap['speed'] = float(speed)
+        except ValueError: pass
+        snap['bitrate'] = block.get('bitrate', 'N/A').strip()
+        out_time = parse_out_time(block.get('out_time'))
+        if out_time is None and 'out_time_us' in snap:
+            out_time = snap['out_time_us'] / 1_000_000
+        if out_time is not None: snap['out_time'] = out_time
+        self.latest = snap
+        return snap
+
+class StreamSession:
+    """
+    One named ffmpeg publisher (one per stream key).
+    A watcher reports exits and a watchdog restarts dead or stalled ffmpeg
+    from the item that was playing, with exponential backoff and a restart budget.
+    """
+    mode = 'concat'
+
+    def __init__(self, name, rtmp_url, items, owner_id, chat_id, bot, env, extra_destinations=None):
+        self.sid = next(_session_ids) # Short id for callback data
+        self.name = name
+        self.rtmp_url = rtmp_url
+        # Every output of the one ffmpeg: the session's own key first, then fan-out keys
+        self.destinations = [
+            {'name': n, 'url': u, 'errors': 0, 'failed': False, 'failed_bytes': None}
+            for n, u in [(name, rtmp_url)] + list(extra_destinations or [])
+        ]
+        self.items = items # resolved entries in playlist order ({'name', 'url', ...})
+        self.owner_id = owner_id
+        self.chat_id = chat_id
+        self.bot = bot
+        self.env = env
+        self.work_dir = session_dir(name)
+        self.playlist_file = os.path.join(self.work_dir, "playlist.txt")
+        self.log_file = os.path.join(self.work_dir, "stream.log")
+        self.log = SessionLog(self.log_file)
+        self.process = None
+        self.state = 'idle' # idle -> queued -> starting -> running <-> recovering -> stopping -> stopped | exited
+        self.returncode = None
+        self.started_at = None
+        self.ended_at = None
+        self.on_exit = [] # callbacks(session) once the session is finished
+        self.total_duration = None # Seconds, when the playlist was probed
+        self._watcher = None
+        self._readers = []
+        # Live telemetry
+        self.parser = ProgressParser()
+        self.current_index = 0
+        self.item_started_at = 0.0 # out_time when the current item was opened
+        self.item_base_offset = 0.0 # inpoint of the item ffmpeg was resumed into
+        self._opened = 0
+        self._input_urls = {} # item index -> URL ffmpeg was given (relay or direct)
+        # Watchdog
+        self.restarts = 0
+        self._restart_times = deque()
+        self._consecutive_failures = 0
+        self._restart_reason = None
+        self._spawned_at = 0.0
+        self._last_out_time = None
+        self._last_advance = 0.0
+        self._slow_since = None
+        self._watchdog = None
+        self._recovery = None
+
+    @property
+    def is_running(self):
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def holds_slot(self):
+        """Counts against scheduler capacity (a recovering session keeps its slot)"""
+        return self.state in ('starting', 'running', 'recovering')
+
+    @property
+    def count(self):
+        return len(self.items)
+
+    @property
+    def progress(self):
+        return self.parser.latest
+
+    @property
+    def current_item(self):
+        if 0 <= self.current_index < len(self.items):
+            return self.items[self.current_index]
+        return None
+
+    @property
+    def item_position(self):
+        """Seconds into the current item"""
+        out_time = self.progress.get('out_time', 0.0)
+        return max(0.0, self.item_base_offset + out_time - self.item_started_at)
+
+    @property
+    def stream_kbps(self):
+        """Bitrate of one output copy: measured once ffmpeg reports it, the configured estimate before"""
+        measured = parse_kbps(self.progress.get('bitrate'))
+        return measured if measured else STREAM_EST_KBPS
+
+    @property
+    def egress_kbps(self):
+        """Upload bandwidth: one copy per destination still connected"""
+        active = sum(1 for d in self.destinations if not d['failed'])
+        return self.stream_kbps * max(1, active)
+
+    @property
+    def bytes_out(self):
+        """Bytes written per destination (tee reports no size, so estimate from time x bitrate)"""
+        size = self.progress.get('total_size')
+        if size and size > 0 and len(self.destinations) == 1: return size
+        return int(self.progress.get('out_time', 0.0) * self.stream_kbps * 125)
+
+    def destination_bytes(self, dest):
+        return dest['failed_bytes'] if dest['failed_bytes'] is not None else self.bytes_out
+
+    def output_args(self, mapped=False):
+        """Single FLV output, or a tee that keeps going when one destination drops"""
+        if len(self.destinations) == 1:
+            return ["-f", "flv", self.rtmp_url]
+        slaves = "|".join(f"[f=flv:onfail=ignore]{tee_escape(d['url'])}" for d in self.destinations)
+        maps = [] if mapped else ["-map", "0:v:0?", "-map", "0:a:0?"] # tee needs explicit maps
+        return maps + ["-f", "tee", slaves]
+
+    def build_cmd(self):
+        # Removed -reconnect options to fix 'Option not found' crash. 
+        # The proxy environment variables are injected via env to help with speed.
+        return [
+            "ffmpeg",
+            "-re", 
+            "-f", "concat",
+            "-safe", "0",
+            "-protocol_whitelist", "file,http,https,tcp,tls",
+            "-i", self.playlist_file,
+            "-c", "copy",
+            "-loglevel", "info", 
+            "-progress", "pipe:1", # Machine-readable telemetry on stdout
+            "-nostats",
+            *self.output_args()
+        ]
+
+    def write_playlist(self, start_index=0, inpoint=0.0):
+        """Concat demuxer input from start_index on; the first entry may resume mid-file"""
+        # Local copies where cached, the rest through the relay (read-ahead, Range resume, pre-open)
+        entries = media_cache.localize_all(self.items[start_index:], self.sid)
+        urls = relay.register_playlist(self.sid, entries)
+        self._input_urls = {start_index + i: url for i, url in enumerate(urls)}
+        lines = []
+        for idx in range(start_index, len(self.items)):
+            safe_url = self._input_urls[idx].replace("'", "'\\''")
+            lines.append(f"file '{safe_url}'\n")
+            if idx == start_index and inpoint > 0:
+                lines.append(f"inpoint {inpoint:.3f}\n")
+        with open(self.playlist_file, "w", encoding='utf-8') as f:
+            f.write("".join(lines))
+
+    def _on_item_opened(self, url):
+        """Advance current_index to the next playlist entry with this URL"""
+        n = len(self.items)
+        start = self.current_index + 1 if self._opened else self.current_index
+        if self._opened: self.item_base_offset = 0.0
+        self._opened += 1
+        for step in range(n):
+            idx = (start + step) % n
+            if self._input_urls.get(idx, self.items[idx].get('url')) == url:
+                self.current_index = idx
+                self.item_started_at = self.progress.get('out_time', 0.0)
+                return
+
+    async def _read_progress(self):
+        """stdout carries `-progress pipe:1` blocks"""
+        while True:
+            line = await self.process.stdout.readline()
+            if not line: break
+            snap = self.parser.feed(line.decode('utf-8', errors='ignore'))
+            if snap and snap.get('out_time') is not None:
+                if self._last_out_time is None or snap['out_time'] > self._last_out_time:
+                    self._last_out_time = snap['out_time']
+                    self._last_advance = time.monotonic()
+
+    async def _read_log(self):
+        """stderr goes to the log ring/file; item switches are picked out on the way"""
+        while True:
+            try: line = await self.process.stderr.readline()
+            except ValueError: continue # Over-long line, skip it
+            if not line: break
+            text = line.decode('utf-8', errors='ignore')
+            self.log.write(text)
+            m = OPENING_RE.search(text)
+            if m: self._on_item_opened(m.group(1))
+            if len(self.destinations) > 1: self._on_tee_log(text)
+
+    def _on_tee_log(self, text):
+        """Attribute tee errors to their destination"""
+        m = TEE_FAILED_RE.search(text)
+        if m:
+            idx = int(m.group(1))
+            if 0 <= idx < len(self.destinations):
+                dest = self.destinations[idx]
+                dest['errors'] += 1
+                if not dest['failed']:
+                    dest['failed'], dest['failed_bytes'] = True, self.bytes_out
+                    logger.warning(f"Session {self.name}: destination {dest['name']} dropped")
+            return
+        m = TEE_SLAVE_RE.search(text)
+        if m:
+            for dest in self.destinations:
+                if tee_escape(dest['url']) in m.group(1):
+                    dest['errors'] += 1
+                    break
+
+    async def start(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.log.open()
+        await self._spawn()
+        self.started_at = time.time()
+        if WATCHDOG_ENABLED:
+            self._watchdog = asyncio.get_running_loop().create_task(self._watchdog_loop())
+
+    async def _spawn(self, start_index=0, inpoint=0.0):
+        """Launch ffmpeg for items[start_index:], resuming the first one at `inpoint` seconds"""
+        self.parser = ProgressParser()
+        self.current_index = start_index
+        self.item_started_at = 0.0
+        self.item_base_offset = inpoint
+        self._opened = 0
+        self._last_out_time = None
+        self._slow_since = None
+        for dest in self.destinations: # A fresh ffmpeg retries every destination
+            dest['failed'], dest['failed_bytes'] = False, None
+        try:
+            self._prepare_input(start_index, inpoint)
+            self.process = await asyncio.create_subprocess_exec(
+                *self.build_cmd(),
+                stdin=self.stdin_mode,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self.env
+            )
+        except Exception:
+            # Relay tokens and media cache pins were taken by _prepare_input: hand them back
+            self._cleanup()
+            raise
+        self.state = 'running'
+        self._spawned_at = self._last_advance = time.monotonic()
+        loop = asyncio.get_running_loop()
+        self._readers = [loop.create_task(self._read_progress()), loop.create_task(self._read_log())]
+        self._watcher = loop.create_task(self._watch_exit())
+        self._after_spawn(start_index, inpoint)
+
+    # Input hooks, overridden by sessions that feed ffmpeg themselves
+    stdin_mode = asyncio.subprocess.DEVNULL
+
+    def _prepare_input(self, start_index, inpoint):
+        self.write_playlist(start_index, inpoint)
+
+    def _after_spawn(self, start_index, inpoint):
+        pass
+
+    async def stop(self, timeout=STREAM_STOP_TIMEOUT):
+        """SIGTERM, wait up to `timeout` seconds, then SIGKILL. Never blocks the loop."""
+        self.state = 'stopping'
+        for task in (self._watchdog, self._recovery):
+            if task and task is not asyncio.current_task(): task.cancel()
+        if self.is_running:
+            try: self.process.terminate()
+            except ProcessLookupError: pass
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"ffmpeg (pid {self.process.pid}) ignored SIGTERM, killing")
+                try: self.process.kill()
+                except ProcessLookupError: pass
+                await self.process.wait()
+        if self._watcher:
+            await asyncio.gather(self._watcher, return_exceptions=True)
+        self.state = 'stopped'
+        self._cleanup()
+        self._fire_exit()
+
+    async def _watch_exit(self):
+        rc = await self.process.wait()
+        # Drain the pipes so the log holds ffmpeg's last words
+        await asyncio.gather(*self._readers, return_exceptions=True)
+        self.returncode = rc
+        self.ended_at = time.time()
+        if self.state != 'running': return
+
+        reason, self._restart_reason = self._restart_reason, None
+        if rc == 0 and not reason:
+            await self._finish("✅ *播放列表已播放完毕*")
+            return
+        if WATCHDOG_ENABLED:
+            self.state = 'recovering'
+            self._recovery = asyncio.get_running_loop().create_task(
+                self._recover(reason or f"ffmpeg 异常退出 (code {rc})")
+            )
+            return
+        await self._finish(f"⚠️ *推流进程已退出* (code {rc})", hint=True)
+
+    async def _finish(self, headline, hint=False):
+        """Session is over for good: clean up, free the scheduler slot, tell the owner (headline is Markdown)"""
+        self.state = 'exited'
+        self._cleanup()
+        self._fire_exit()
+        if self._watchdog and self._watchdog is not asyncio.current_task():
+            self._watchdog.cancel()
+        logger.warning(f"Session {self.name} finished (code {self.returncode}): {headline}")
+        text = f"{headline}\n🔑 目标: {escape_markdown(self.name)}"
+        if hint: text += "\n请点击【查看日志】排查原因。"
+        await self._notify(text)
+
+    async def _notify(self, text):
+        try:
+            await self.bot.send_message(self.chat_id, text, parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Session notification failed: {e}")
+
+    # --- Watchdog ---
+
+    def _check_stall(self):
+        """Reason string when the running ffmpeg looks stuck, else None"""
+        now = time.monotonic()
+        if now - self._last_advance > WATCHDOG_STALL_SECS:
+            return f"输出停滞超过 {WATCHDOG_STALL_SECS} 秒"
+        speed = self.progress.get('speed')
+        if speed is not None and now - self._spawned_at > WATCHDOG_SLOW_SECS:
+            if speed < WATCHDOG_MIN_SPEED:
+                self._slow_since = self._slow_since or now
+                if now - self._slow_since > WATCHDOG_SLOW_SECS:
+                    return f"速度持续低于 {WATCHDOG_MIN_SPEED}x ({speed:.2f}x)"
+            else:
+                self._slow_since = None
+        return None
+
+    async def _watchdog_loop(self):
+        while self.state not in ('stopping', 'stopped', 'exited'):
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+            if self.state != 'running' or not self.is_running: continue
+            if time.monotonic() - self._spawned_at > WATCHDOG_STABLE_SECS:
+                self._consecutive_failures = 0
+            reason = self._check_stall()
+            if reason:
+                logger.warning(f"Session {self.name} stalled: {reason}")
+                self._restart_reason = reason
+                try: self.process.kill() # _watch_exit takes over from here
+                except ProcessLookupError: pass
+
+    async def _recover(self, reason):
+        now = time.monotonic()
+        while self._restart_times and now - self._restart_times[0] > WATCHDOG_WINDOW:
+            self._restart_times.popleft()
+        if len(self._restart_times) >= WATCHDOG_MAX_RESTARTS:
+            await self._finish(f"⛔ *推流已放弃恢复*: {escape_markdown(reason)}\n(重启次数已达上限 {WATCHDOG_MAX_RESTARTS})", hint=True)
+            return
+
+        index, offset = self.current_index, self.item_position
+        delay = min(WATCHDOG_BACKOFF_MAX, WATCHDOG_BACKOFF * 2 ** self._consecutive_failures)
+        self._consecutive_failures += 1
+        self._restart_times.append(now)
+        self.restarts += 1
+        item = self.current_item or {'name': '?'}
+        await self._notify(
+            f"⚠️ *{escape_markdown(reason)}*，{delay:g} 秒后自动恢复\n"
+            f"🔑 目标: {escape_markdown(self.name)}\n"
+            f"▶️ 从第 {index + 1} 个文件 ({escape_markdown(item['name'])}) {offset:.0f}s 处继续"
+        )
+        await asyncio.sleep(delay)
+        if self.state != 'recovering': return
+
+        # Re-resolve what has expired; the failing item's link is always refreshed
+        if self.current_item: link_cache.invalidate(self.current_item['path'])
+        remaining = self.items[index:]
+        resolved, failed = await resolve_playlist(remaining)
+        if self.state != 'recovering': return
+        if not resolved:
+            await self._finish("❌ *恢复失败*: 无法重新获取文件链接", hint=True)
+            return
+        fresh = {r['path']: r for r in resolved}
+        for idx in range(index, len(self.items)):
+            old = self.items[idx]
+            entry = fresh.get(old['path'])
+            if entry is None: continue
+            if (entry.get('size'), entry.get('modified')) == (old.get('size'), old.get('modified')):
+                # Same file: keep its probe result, or compat mode would transcode matching items
+                entry = {**entry, **{k: old[k] for k in PROBE_KEYS if k in old}}
+            self.items[idx] = entry
+        if self.items[index]['path'] not in fresh: offset = 0.0 # Resume item dropped, start the next cleanly
+        self.items = self.items[:index] + [it for it in self.items[index:] if it['path'] in fresh]
+        if index >= len(self.items):
+            await self._finish("✅ *播放列表已播放完毕*")
+            return
+
+        try:
+            await self._spawn(index, offset)
+            logger.info(f"Session {self.name} resumed at item {index} +{offset:.1f}s")
+        except Exception as e:
+            await self._finish(f"❌ *恢复失败*: {escape_markdown(str(e))}", hint=True)
+
+    def _fire_exit(self):
+        for callback in self.on_exit:
+            try: callback(self)
+            except Exception as e: logger.error(f"on_exit callback failed: {e}")
+
+    def _cleanup(self):
+        self.log.close()
+        relay.release(self.sid)
+        media_cache.release(self.sid)
+        if self.playlist_file and os.path.exists(self.playlist_file):
+            try: os.remove(self.playlist_file)
+            except OSError: pass
+
+class SchedulerFull(Exception):
+    pass
+
+class StreamScheduler:
+    """
+    Caps concurrent ffmpeg publishers and their summed egress bitrate.
+    Sessions that do not fit wait in a FIFO queue (up to STREAM_QUEUE_MAX)
+    and start as soon as a running session frees enough capacity.
+    """
+    def __init__(self, max_streams=MAX_CONCURRENT_STREAMS, max_kbps=MAX_TOTAL_EGRESS_KBPS, queue_max=STREAM_QUEUE_MAX):
+        self.max_streams = max_streams
+        self.max_kbps = max_kbps
+        self.queue_max = queue_max
+        self.queue = deque()
+
+    def running(self):
+        return [s for s in stream_sessions.values() if s.holds_slot]
+
+    def usage(self):
+        running = self.running()
+        return len(running), sum(s.egress_kbps for s in running)
+
+    def fits(self, session):
+        count, kbps = self.usage()
+        if count >= self.max_streams: return False
+        # A lone stream always fits, whatever its bitrate
+        return count == 0 or kbps + session.egress_kbps <= self.max_kbps
+
+    async def submit(self, session):
+        """Start now or queue; returns 'started' / 'queued', raises SchedulerFull"""
+        session.on_exit.append(lambda s: self._schedule_drain())
+        if not self.queue and self.fits(session):
+            # Reserve the slot before the first await, or concurrent launches all pass fits()
+            session.state = 'starting'
+            try:
+                await session.start()
+            except Exception:
+                session.state = 'exited'
+                raise
+            return 'started'
+        if len(self.queue) >= self.queue_max:
+            count, kbps = self.usage()
+            raise SchedulerFull(f"{count} 路推流运行中 ({kbps:.0f} kbps)，排队已满 ({self.queue_max})")
+        session.state = 'queued'
+        self.queue.append(session)
+        return 'queued'
+
+    def cancel(self, session):
+        try: self.queue.remove(session)
+        except ValueError: return False
+        session.state = 'stopped'
+        return True
+
+    def _schedule_drain(self):
+        asyncio.get_running_loop().create_task(self.drain())
+
+    async def drain(self):
+        """Start queued sessions while capacity allows"""
+        while self.queue and self.fits(self.queue[0]):
+            session = self.queue.popleft()
+            session.state = 'starting' # Slot reserved: a concurrent drain sees it as taken
+            async with session_locks.hold(session.name):
+                if stream_sessions.get(session.name) is not session: # Replaced or stopped meanwhile
+                    session.state = 'stopped'
+                    continue
+                try:
+                    await session.start()
+                except Exception as e:
+                    logger.error(f"Queued session {session.name} failed to start: {e}")
+                    session.state = 'exited'
+                    continue
+            try: await session.bot.send_message(session.chat_id, f"▶️ 排队中的推流 *{escape_markdown(session.name)}* 已启动", parse_mode='Markdown')
+            except Exception as e: logger.warning(f"Cannot announce {session.name}: {e}")
+
+scheduler = StreamScheduler()
+
+def get_session(name):
+    return stream_sessions.get(name)
+
+def get_session_by_id(sid, include_finished=False):
+    pool = list(stream_sessions.values()) + (list(finished_sessions.values()) if include_finished else [])
+    return next((s for s in pool if s.sid == sid), None)
+
+def sessions_using(key_names):
+    """Sessions publishing to any of these keys (as their own key or a fan-out)"""
+    names = set(key_names)
+    return [s for s in stream_sessions.values() if names & {d['name'] for d in s.destinations}]
+
+async def launch_session(session):
+    """
+    Stop whatever publishes to the session's keys, register it and hand it to
+    the scheduler ('started' / 'queued', raises SchedulerFull) - all while
+    holding the locks of every stream key involved.
+    """
+    keys = [d['name'] for d in session.destinations]
+    while True:
+        names = set(keys) | {s.name for s in sessions_using(keys)}
+        async with session_locks.hold_many(names):
+            # A session on yet another key may have appeared while we waited: lock that too
+            if not {s.name for s in sessions_using(keys)} <= names: continue
+            for old in sessions_using(keys):
+                await _stop_session(old.name)
+            stream_sessions[session.name] = session
+            try:
+                return await scheduler.submit(session)
+            except Exception:
+                if stream_sessions.get(session.name) is session: stream_sessions.pop(session.name)
+                raise
+
+async def stop_session(name):
+    """Stop and forget a session; returns True if it was running or queued"""
+    async with session_locks.hold(name):
+        return await _stop_session(name)
+
+async def _stop_session(name):
+    session = stream_sessions.pop(name, None)
+    if not session: return False
+    if scheduler.cancel(session): return True
+    was_running = session.is_running
+    await session.stop()
+    finished_sessions[name] = session
+    return was_running
+
+async def stop_all_sessions():
+    scheduler.queue.clear()
+    await asyncio.gather(*(stop_session(name) for name in list(stream_sessions)), return_exceptions=True)
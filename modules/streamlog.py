@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from .config import LOG_RING_BYTES, LOG_FILE_MAX_BYTES, LOG_BACKUPS
+
+logger = logging.getLogger("StreamLog")
+
+class LogRing:
+    """Recent log lines kept in memory, bounded by total bytes"""
+    def __init__(self, max_bytes=LOG_RING_BYTES):
+        self.max_bytes = max_bytes
+        self._lines = deque()
+        self._bytes = 0
+
+    def append(self, line):
+        size = len(line.encode('utf-8', errors='ignore'))
+        self._lines.append((line, size))
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._lines) > 1:
+            _, dropped = self._lines.popleft()
+            self._bytes -= dropped
+
+    def tail(self, n):
+        """Last n non-blank lines"""
+        out = []
+        for line, _ in reversed(self._lines):
+            if line.strip():
+                out.append(line.rstrip("\n"))
+                if len(out) >= n: break
+        return list(reversed(out))
+
+    def dump(self, max_bytes=None):
+        """Most recent lines totalling at most max_bytes, as UTF-8"""
+        budget = max_bytes or self.max_bytes
+        chunks = []
+        for line, size in reversed(self._lines):
+            if size > budget: break
+            chunks.append(line)
+            budget -= size
+        return "".join(reversed(chunks)).encode('utf-8', errors='ignore')
+
+class RotatingLog:
+    """
+    Append-only log file rotated at max_bytes. Rotated segments are gzip-
+    compressed off the event loop as <name>.1.gz ... <name>.<backups>.gz.
+    """
+    _lock = threading.Lock() # Serialises shift+compress jobs
+
+    def __init__(self, path, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_BACKUPS, append=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._fh = open(path, "a" if append else "w", encoding='utf-8')
+        self._size = self._fh.tell()
+
+    def write(self, text):
+        if self._fh is None: return
+        self._fh.write(text)
+        self._fh.flush()
+        self._size += len(text.encode('utf-8', errors='ignore'))
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._fh.close()
+        segment = f"{self.path}.{time.time_ns()}.tmp"
+        os.replace(self.path, segment)
+        self._fh = open(self.path, "w", encoding='utf-8')
+        self._size = 0
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._archive, segment)
+        except RuntimeError: # No loop (shutdown path)
+            self._archive(segment)
+
+    def _archive(self, segment):
+        with self._lock:
+            try:
+                # Shift older archives, dropping the oldest
+                for i in range(self.backups - 1, 0, -1):
+                    src = f"{self.path}.{i}.gz"
+                    if os.path.exists(src): os.replace(src, f"{self.path}.{i + 1}.gz")
+                if self.backups > 0:
+                    with open(segment, 'rb') as fin, gzip.open(f"{self.path}.1.gz", 'wb') as fout:
+                        shutil.copyfileobj(fin, fout)
+            except OSError as e:
+                logger.error(f"Log rotation failed for {self.path}: {e}")
+            finally:
+                try: os.remove(segment)
+                except OSError: pass
+
+    def close(self):
+        if self._fh:
+            try: self._fh.close()
+            except OSError: pass
+            self._fh = None
+
+class SessionLog:
+    """ffmpeg stderr sink: in-memory ring for previews + rotated file on disk"""
+    def __init__(self, path):
+        self.path = path
+        self.ring = LogRing()
+        self._file = None
+
+    def open(self, append=False):
+        self.close()
+        self._file = RotatingLog(self.path, append=append)
+
+    def write(self, text):
+        self.ring.append(text)
+        if self._file: self._file.write(text)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,86 @@
+import os
+from .config import (
+    TARGET_PROFILE, TARGET_WIDTH, TARGET_HEIGHT, TARGET_FPS, TARGET_VIDEO_KBPS,
+    TARGET_AUDIO_KBPS, TARGET_AUDIO_RATE, TRANSCODE_PRESET, TRANSCODE_THREADS
+)
+
+def transcode_threads():
+    """x264 threads: leave a core for the publisher/bot, more than 4 only adds latency on phones"""
+    if TRANSCODE_THREADS > 0: return TRANSCODE_THREADS
+    return min(4, max(1, (os.cpu_count() or 2) - 1))
+
+class TargetProfile:
+    """The one format every item is fed to the publisher in (H.264 + AAC in MPEG-TS)"""
+    def __init__(self, width=TARGET_WIDTH, height=TARGET_HEIGHT, fps=TARGET_FPS,
+                 audio_rate=TARGET_AUDIO_RATE, channels=2):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_rate = audio_rate
+        self.channels = channels
+
+    def __str__(self):
+        return f"{self.width}x{self.height}@{self.fps:g} H.264 / AAC {self.audio_rate}Hz"
+
+    @classmethod
+    def for_playlist(cls, reference):
+        """
+        With TARGET_PROFILE=auto, adopt the playlist's dominant signature (see
+        probe.signature) when it is H.264/yuv420p + AAC, so the majority is copied.
+        Otherwise fall back to the configured profile.
+        """
+        if TARGET_PROFILE == 'auto' and reference:
+            vcodec, w, h, fps, pix_fmt, acodec, rate, channels = reference
+            if vcodec == 'h264' and pix_fmt == 'yuv420p' and acodec == 'aac' and w and h and fps and rate and channels in (1, 2):
+                return cls(w, h, fps, rate, channels)
+        return cls()
+
+    def matches(self, info):
+        """True if a probed file can be stream-copied as is"""
+        if not info: return False
+        v, a = info.get('video'), info.get('audio')
+        if not v or not a: return False
+        return (
+            v.get('codec') == 'h264' and v.get('pix_fmt') == 'yuv420p'
+            and (v.get('width'), v.get('height')) == (self.width, self.height)
+            and abs((v.get('fps') or 0) - self.fps) < 0.05
+            and a.get('codec') == 'aac' and a.get('sample_rate') == self.audio_rate
+            and a.get('channels') == self.channels
+        )
+
+    def input_args(self, info):
+        """Synthetic inputs for streams the file lacks (black video / silence), paced like the file"""
+        args = []
+        if info and not info.get('video'):
+            args += ["-re", "-f", "lavfi", "-i", f"color=c=black:s={self.width}x{self.height}:r={self.fps:g}"]
+        if info and not info.get('audio'):
+            layout = "stereo" if self.channels == 2 else "mono"
+            args += ["-re", "-f", "lavfi", "-i", f"anullsrc=r={self.audio_rate}:cl={layout}"]
+        return args
+
+    def encode_args(self, info):
+        """Map + filter + encoder options normalizing input 0 (plus synthetic inputs) to this profile"""
+        # Unprobed files are assumed to carry both streams
+        has_video = not info or bool(info.get('video'))
+        has_audio = not info or bool(info.get('audio'))
+        synthetic = 1
+        if has_video: vmap = "0:v:0"
+        else: vmap, synthetic = f"{synthetic}:v:0", synthetic + 1
+        amap = "0:a:0" if has_audio else f"{synthetic}:a:0"
+        w, h = self.width, self.height
+        vf = (
+            f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+            f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={self.fps:g},format=yuv420p"
+        )
+        gop = max(1, round(self.fps * 2))
+        args = [
+            "-map", vmap, "-map", amap,
+            "-vf", vf,
+            "-c:v", "libx264", "-preset", TRANSCODE_PRESET, "-threads", str(transcode_threads()),
+            "-b:v", f"{TARGET_VIDEO_KBPS}k", "-maxrate", f"{TARGET_VIDEO_KBPS}k",
+            "-bufsize", f"{TARGET_VIDEO_KBPS * 2}k", "-g", str(gop),
+            "-c:a", "aac", "-b:a", f"{TARGET_AUDIO_KBPS}k",
+            "-ar", str(self.audio_rate), "-ac", str(self.channels),
+        ]
+        if not (has_video and has_audio): args.append("-shortest")
+        return args
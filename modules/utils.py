@@ -1,10 +1,16 @@
 
 import socket
 import os
+import re
 import logging
 
 logger = logging.getLogger("Utils")
 
+# --- Media Types ---
+VIDEO_EXTS = ('.mp4', '.mkv', '.avi', '.mov', '.flv', '.webm', '.ts', '.m2ts')
+AUDIO_EXTS = ('.mp3', '.flac', '.wav', '.m4a', '.aac', '.ogg', '.wma')
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
+
 def get_local_ip():
     """Get local IP using socket which is more robust on Android/Termux"""
     try:
@@ -46,3 +52,7 @@ def format_bytes(size):
         size /= power
         n += 1
     return f"{size:.2f} {power_labels[n]}B"
+
+def natural_key(text):
+    """Sort key where 'ep2' < 'ep10'"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', text)]
@@ -0,0 +1,67 @@
+import hashlib
+import hmac
+import logging
+from aiohttp import web
+from telegram import Update
+from .config import BOT_TOKEN, WEB_PORT, WEBHOOK_LISTEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+from .utils import get_base_url
+
+logger = logging.getLogger("Webhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def webhook_secret():
+    """WEBHOOK_SECRET, or one derived from the bot token so it is stable across restarts"""
+    if WEBHOOK_SECRET: return WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{BOT_TOKEN}".encode('utf-8')).hexdigest()
+
+def webhook_url():
+    """Where Telegram should post updates; without WEBHOOK_URL the LAN address (local Bot API servers only)"""
+    base = WEBHOOK_URL or get_base_url(WEB_PORT)
+    return base.rstrip('/') + WEBHOOK_PATH
+
+class WebhookServer:
+    """
+    Receives Telegram updates on WEB_PORT and hands them to the application's
+    update queue. Requests without the secret token header are rejected.
+    """
+    def __init__(self, application, secret=None, path=WEBHOOK_PATH, host=WEBHOOK_LISTEN, port=WEB_PORT):
+        self.application = application
+        self.secret = secret or webhook_secret()
+        self.path = path
+        self.host = host
+        self.port = port
+        self._runner = None
+        self.received = 0
+        self.rejected = 0
+
+    async def handle(self, request):
+        given = request.headers.get(SECRET_HEADER, "").encode('utf-8')
+        if not hmac.compare_digest(given, self.secret.encode('utf-8')):
+            self.rejected += 1
+            logger.warning(f"Rejected webhook call from {request.remote}: bad secret token")
+            raise web.HTTPForbidden()
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Malformed update: {e}")
+            raise web.HTTPBadRequest()
+        self.received += 1
+        # Answer at once; the application processes the queue on its own
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        self._runner = runner
+        logger.info(f"Webhook listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None